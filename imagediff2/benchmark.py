@@ -0,0 +1,219 @@
+"""
+Benchmark the diff and matrix paths on a synthetic screenshot tree.
+
+    python -m imagediff2.benchmark --targets 2 --builds 10 --movies 20 --frames 30 \
+        --width 640 --height 360 --diff-rate 0.1 --output bench.json
+
+Each layer (listing, decode, diff, encode, JSON assembly) is timed on its
+own and reported as items/sec with p50/p99 latency, together with the peak
+RSS of the process. Results are written as JSON so runs can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+def generate_tree(root, targets, builds, movies, frames, width, height, diff_rate, seed):
+    """
+    Write a synthetic SCREENSHOTS_DIR tree.
+
+    Every frame of the first build is random content. Later builds copy the
+    previous build's file byte for byte, except that a diff_rate fraction of
+    frames gets a changed rectangle.
+    """
+    rng = np.random.default_rng(seed)
+    rand = random.Random(seed)
+
+    for t in range(targets):
+        prev_build_path = None
+        for b in range(builds):
+            build_path = os.path.join(root, f"target{t:02d}", f"build-{b:04d}")
+            os.makedirs(build_path)
+
+            for m in range(movies):
+                for f in range(frames):
+                    filename = f"movie{m:03d}-{f}.png"
+                    path = os.path.join(build_path, filename)
+
+                    if prev_build_path is None or rand.random() < diff_rate:
+                        if prev_build_path is None:
+                            pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+                        else:
+                            with Image.open(os.path.join(prev_build_path, filename)) as prev:
+                                pixels = np.array(prev)
+                            x, y = rand.randrange(width - 16), rand.randrange(height - 16)
+                            pixels[y:y + 16, x:x + 16] = rng.integers(0, 256, 3, dtype=np.uint8)
+                        Image.fromarray(pixels).save(path, format="PNG")
+                    else:
+                        shutil.copyfile(os.path.join(prev_build_path, filename), path)
+
+            prev_build_path = build_path
+
+class Layer:
+    """Latency samples of one benchmarked layer."""
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+
+    def time(self, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.samples.append(time.perf_counter() - start)
+        return result
+
+    def summary(self):
+        samples = np.asarray(self.samples)
+        total = float(samples.sum()) if samples.size else 0.0
+        return {
+            'count': int(samples.size),
+            'total_s': total,
+            'per_sec': samples.size / total if total else None,
+            'p50_ms': float(np.percentile(samples, 50) * 1000) if samples.size else None,
+            'p99_ms': float(np.percentile(samples, 99) * 1000) if samples.size else None,
+        }
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def run(root, workers):
+    """Time every layer on the tree under root and return the per-layer summaries."""
+    os.environ['SCREENSHOTS_DIR'] = root
+    os.environ['IMAGEDIFF_WORKERS'] = str(workers)
+    # Matrix requests wait for their background job instead of answering 202 with its progress
+    os.environ['IMAGEDIFF_JOB_WAIT'] = str(24 * 3600)
+
+    # Imported late so that the configuration above is picked up
+    from imagediff2.cache import diff_cache
+    from imagediff2.decode import open_images
+    from imagediff2.imagediff import encode_image, frames_differ, movie_diff
+    from imagediff2.manifest import get_manifest, list_subdirs, scan_build, sorted_builds
+
+    layers = {name: Layer(name) for name in
+              ('listing', 'decode', 'encode', 'diff_cold', 'diff_warm', 'movie_diff',
+               'target_data_cold', 'target_data_warm', 'json')}
+
+    targets = list_subdirs(root)
+    for target in targets:
+        target_path = os.path.join(root, target)
+        builds = sorted_builds(target_path)
+
+        for build in builds:
+            layers['listing'].time(scan_build, os.path.join(target_path, build))
+        manifests = {build: get_manifest(os.path.join(target_path, build)) for build in builds}
+
+        # Decode and encode every frame of the newest build
+        newest = manifests[builds[0]]
+        for filename in newest.frame_files():
+            path = os.path.join(newest.path, filename)
+            with open_images(path) as (image,):
+                image = layers['decode'].time(image.convert, 'RGB')
+            layers['encode'].time(encode_image, image)
+
+        # Frame pairs between consecutive builds, first against a cold then a warm cache
+        pairs = []
+        for current, previous in zip(builds, builds[1:]):
+            for movie in manifests[current].movie_names():
+                for frame in manifests[current].frames(movie):
+                    pairs.append((manifests[current].frame_path(movie, frame),
+                                  manifests[previous].frame_path(movie, frame)))
+        # A reused --root tree comes with the verdicts of the previous run
+        diff_cache.clear_verdicts()
+        for layer in ('diff_cold', 'diff_warm'):
+            for src, cmp in pairs:
+                layers[layer].time(frames_differ, src, cmp)
+
+        for current, previous in zip(builds, builds[1:]):
+            for movie in manifests[current].movie_names():
+                layers['movie_diff'].time(movie_diff, current, previous, target, movie)
+
+    from imagediff2.main import app
+    from imagediff2.serving import jobs
+    client = app.test_client()
+
+    def get_target_data(target):
+        # Finished jobs are forgotten first, so every request is computed from the diff cache
+        jobs.clear()
+        response = client.get(f"/api/target_data/{target}")
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/target_data/{target} answered {response.status_code}")
+        return response
+
+    for target in targets:
+        # Clear the verdict cache so the cold request recomputes every diff
+        diff_cache.clear_verdicts()
+
+        layers['target_data_cold'].time(get_target_data, target)
+        response = layers['target_data_warm'].time(get_target_data, target)
+        payload = response.get_json()
+        layers['json'].time(json.dumps, payload)
+
+    return {name: layer.summary() for name, layer in layers.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ImageDiff on a synthetic screenshot tree.")
+    parser.add_argument('--targets', type=int, default=2)
+    parser.add_argument('--builds', type=int, default=5)
+    parser.add_argument('--movies', type=int, default=10)
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--width', type=int, default=320)
+    parser.add_argument('--height', type=int, default=240)
+    parser.add_argument('--diff-rate', type=float, default=0.1, help="fraction of frames changed per build")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help="frame comparison worker processes")
+    parser.add_argument('--root', help="reuse or keep the generated tree in this directory")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix="imagediff-bench-")
+    root = os.path.join(root, '')
+    os.makedirs(root, exist_ok=True)
+    try:
+        if not os.listdir(root):
+            start = time.perf_counter()
+            generate_tree(root, args.targets, args.builds, args.movies, args.frames,
+                          args.width, args.height, args.diff_rate, args.seed)
+            print(f"Generated tree in {root} in {time.perf_counter() - start:.1f}s")
+
+        layers = run(root, args.workers)
+    finally:
+        if not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+
+    from imagediff2.decode import decode_stats
+    results = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('root', 'output')},
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'peak_rss_mb': peak_rss_mb(),
+        'decode': decode_stats(),
+        'layers': layers,
+    }
+
+    print(f"{'layer':<18}{'count':>8}{'per sec':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, layer in layers.items():
+        per_sec = f"{layer['per_sec']:.1f}" if layer['per_sec'] else '-'
+        p50 = f"{layer['p50_ms']:.2f}" if layer['p50_ms'] is not None else '-'
+        p99 = f"{layer['p99_ms']:.2f}" if layer['p99_ms'] is not None else '-'
+        print(f"{name:<18}{layer['count']:>8}{per_sec:>12}{p50:>10}{p99:>10}")
+    print(f"peak RSS: {results['peak_rss_mb']:.1f} MB, "
+          f"peak decoded in flight: {results['decode']['peak'] / (1024 * 1024):.1f} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
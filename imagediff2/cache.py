@@ -0,0 +1,259 @@
+import os
+import sqlite3
+import threading
+import time
+
+from imagediff2.config import CACHE_DB, CACHE_MAX_ENTRIES, CACHE_WAL
+from imagediff2.metrics import count_cache_lookup
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frame_verdicts (
+    key TEXT PRIMARY KEY,
+    has_diff INTEGER NOT NULL,
+    bbox TEXT,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS movie_verdicts (
+    key TEXT PRIMARY KEY,
+    has_diff INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_digests (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS build_manifests (
+    key TEXT PRIMARY KEY,
+    manifest TEXT NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ingested_builds (
+    key TEXT PRIMARY KEY,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS frame_signatures (
+    key TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    sums BLOB NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS movie_histories (
+    key TEXT PRIMARY KEY,
+    history TEXT NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS frame_verdicts_accessed ON frame_verdicts (accessed);
+CREATE INDEX IF NOT EXISTS movie_verdicts_accessed ON movie_verdicts (accessed);
+CREATE INDEX IF NOT EXISTS file_digests_accessed ON file_digests (accessed);
+CREATE INDEX IF NOT EXISTS build_manifests_accessed ON build_manifests (accessed);
+CREATE INDEX IF NOT EXISTS ingested_builds_accessed ON ingested_builds (accessed);
+CREATE INDEX IF NOT EXISTS frame_signatures_accessed ON frame_signatures (accessed);
+CREATE INDEX IF NOT EXISTS movie_histories_accessed ON movie_histories (accessed);
+"""
+
+# Number of writes between two eviction passes
+EVICT_EVERY = 1000
+
+# Number of cache hits whose access time is recorded in memory before being written in one transaction
+ACCESS_FLUSH_EVERY = 1000
+
+def file_identity(path, st=None):
+    """Identify a file by its absolute path, size and modification time."""
+    if st is None:
+        st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+class DiffCache:
+    """
+    Persistent SQLite store of frame-pair and movie-pair verdicts, of the
+    content digests and low-resolution signatures of individual screenshots,
+    of build manifests, of the history of every movie and of the builds
+    already precomputed by the ingester.
+
+    Entries are keyed on file identity, so a rewritten screenshot or a
+    re-uploaded build never hits a stale verdict. Each table is trimmed to
+    max_entries by evicting the least recently used rows. Lookups only read
+    the database: access times of hits are kept in memory and written in
+    batches, so recency is approximate and hits never wait for the write lock.
+
+    The cache is only an accelerator: a locked or failing database turns
+    lookups into misses and drops writes instead of failing the request.
+    The rollback journal is used unless wal is set, since WAL does not work
+    on network filesystems.
+    """
+
+    def __init__(self, path, max_entries, wal=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.wal = wal
+        self._local = threading.local()
+        self._writes = 0
+        self._accessed = {}
+        self._accessed_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection inherited from a forked parent must not be reused
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = None
+        if conn is None and self.enabled:
+            try:
+                conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+                try:
+                    conn.execute(f"PRAGMA journal_mode={'WAL' if self.wal else 'DELETE'}")
+                except sqlite3.OperationalError:
+                    # Another connection holds the database; its journal mode stays until the next open
+                    pass
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(SCHEMA)
+            except sqlite3.Error as e:
+                print(f"Diff cache disabled, cannot open {self.path}: {e}")
+                self.path = None
+                return None
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get(self, table, key, columns):
+        conn = self._connect()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute(f"SELECT {columns} FROM {table} WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading {table} from the diff cache: {e}")
+            row = None
+        count_cache_lookup(table, row is not None)
+        if row is not None:
+            with self._accessed_lock:
+                self._accessed[(table, key)] = time.time()
+                flush = len(self._accessed) >= ACCESS_FLUSH_EVERY
+            if flush:
+                self.flush_accessed()
+        return row
+
+    def flush_accessed(self):
+        """Write the access times recorded by lookups in a single transaction."""
+        conn = self._connect()
+        with self._accessed_lock:
+            accessed, self._accessed = self._accessed, {}
+        if conn is None or not accessed:
+            return
+        by_table = {}
+        for (table, key), when in accessed.items():
+            by_table.setdefault(table, []).append((when, key))
+        try:
+            conn.execute("BEGIN")
+            for table, rows in by_table.items():
+                conn.executemany(f"UPDATE {table} SET accessed = ? WHERE key = ?", rows)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"Error writing access times to the diff cache: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+    def _put(self, table, columns, values):
+        conn = self._connect()
+        if conn is None:
+            return
+        placeholders = ", ".join("?" for _ in range(len(values) + 1))
+        try:
+            conn.execute(f"INSERT OR REPLACE INTO {table} ({columns}, accessed) VALUES ({placeholders})",
+                         (*values, time.time()))
+
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self.evict()
+        except sqlite3.Error as e:
+            print(f"Error writing {table} to the diff cache: {e}")
+
+    def evict(self):
+        """Drop the least recently used rows above max_entries in every table."""
+        conn = self._connect()
+        if conn is None:
+            return
+        self.flush_accessed()
+        for table in ('frame_verdicts', 'movie_verdicts', 'file_digests', 'build_manifests', 'ingested_builds',
+                      'frame_signatures', 'movie_histories'):
+            conn.execute(f"""
+                DELETE FROM {table} WHERE key IN (
+                    SELECT key FROM {table} ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+
+    def clear_verdicts(self):
+        """Forget every frame and movie verdict and the movie histories, keeping digests and manifests."""
+        conn = self._connect()
+        if conn is None:
+            return
+        conn.execute("DELETE FROM frame_verdicts")
+        conn.execute("DELETE FROM movie_verdicts")
+        conn.execute("DELETE FROM movie_histories")
+
+    def get_frame(self, key):
+        row = self._get('frame_verdicts', key, 'has_diff, bbox')
+        if row is None:
+            return None
+        bbox = tuple(int(v) for v in row[1].split(',')) if row[1] else None
+        return {'has_diff': bool(row[0]), 'bbox': bbox}
+
+    def put_frame(self, key, result):
+        bbox = result.get('bbox')
+        self._put('frame_verdicts', 'key, has_diff, bbox',
+                  (key, int(result['has_diff']), ','.join(str(v) for v in bbox) if bbox else None))
+
+    def get_movie(self, key):
+        row = self._get('movie_verdicts', key, 'has_diff')
+        return None if row is None else bool(row[0])
+
+    def put_movie(self, key, has_diff):
+        self._put('movie_verdicts', 'key, has_diff', (key, int(has_diff)))
+
+    def get_digest(self, key):
+        row = self._get('file_digests', key, 'digest')
+        return None if row is None else row[0]
+
+    def put_digest(self, key, digest):
+        self._put('file_digests', 'key, digest', (key, digest))
+
+    def get_manifest(self, key):
+        row = self._get('build_manifests', key, 'manifest')
+        return None if row is None else row[0]
+
+    def put_manifest(self, key, manifest):
+        self._put('build_manifests', 'key, manifest', (key, manifest))
+
+    def get_signature(self, key):
+        return self._get('frame_signatures', key, 'mode, width, height, sums')
+
+    def put_signature(self, key, mode, width, height, sums):
+        self._put('frame_signatures', 'key, mode, width, height, sums', (key, mode, width, height, sums))
+
+    def get_history(self, key):
+        row = self._get('movie_histories', key, 'history')
+        return None if row is None else row[0]
+
+    def put_history(self, key, history):
+        self._put('movie_histories', 'key, history', (key, history))
+
+    def is_ingested(self, key):
+        return self._get('ingested_builds', key, 'key') is not None
+
+    def mark_ingested(self, key):
+        self._put('ingested_builds', 'key', (key,))
+
+def frame_key(src_img_path, cmp_img_path, variant='exact'):
+    """Cache key of a frame-pair verdict."""
+    return f"{variant}|{file_identity(src_img_path)}|{file_identity(cmp_img_path)}"
+
+def movie_key(src_build_path, cmp_build_path, movie, variant='exact'):
+    """Cache key of a movie-pair verdict, invalidated whenever either build directory changes."""
+    return f"{variant}|{movie}|{file_identity(src_build_path)}|{file_identity(cmp_build_path)}"
+
+diff_cache = DiffCache(CACHE_DB, CACHE_MAX_ENTRIES, CACHE_WAL)
@@ -1,3 +1,72 @@
 import os
 
 SCREENSHOTS_DIR = os.environ.get("SCREENSHOTS_DIR", "./screenshots/")
+
+# Persistent verdict cache, stored next to the screenshots. Set to an empty string to disable.
+# Point it at a local disk when the screenshots live on NFS; SQLite locking is slow and fragile there.
+CACHE_DB = os.environ.get("IMAGEDIFF_CACHE_DB", os.path.join(SCREENSHOTS_DIR, ".imagediff-cache.sqlite3"))
+# WAL journal for concurrent readers and writers, only safe when CACHE_DB is on a local filesystem
+CACHE_WAL = os.environ.get("IMAGEDIFF_CACHE_WAL", "0") not in ("", "0", "false", "no")
+CACHE_MAX_ENTRIES = int(os.environ.get("IMAGEDIFF_CACHE_MAX_ENTRIES", "1000000"))
+
+# Worker processes used to compare frame pairs; 1 compares them inline.
+DIFF_WORKERS = int(os.environ.get("IMAGEDIFF_WORKERS", str(os.cpu_count() or 1)))
+
+# Default diff kernel ('pil' or 'numpy') and tolerances. A channel tolerance of
+# "2" or "2,2,4" ignores per-channel deltas up to that value; the pixel tolerance
+# is the number of changed pixels still reported as no difference.
+DIFF_KERNEL = os.environ.get("IMAGEDIFF_KERNEL", "pil")
+DIFF_CHANNEL_TOLERANCE = os.environ.get("IMAGEDIFF_CHANNEL_TOLERANCE", "0")
+DIFF_PIXEL_TOLERANCE = int(os.environ.get("IMAGEDIFF_PIXEL_TOLERANCE", "0"))
+
+# Rendered diff images are cached on disk here
+DIFF_IMAGE_DIR = os.environ.get("IMAGEDIFF_DIFF_IMAGE_DIR", os.path.join(SCREENSHOTS_DIR, ".imagediff-diffs"))
+# Lossless format of diff images, PNG or WEBP
+DIFF_IMAGE_FORMAT = os.environ.get("IMAGEDIFF_DIFF_IMAGE_FORMAT", "PNG").upper()
+# zlib level of encoded PNGs; diff images are mostly black, so a fast level barely grows them
+PNG_COMPRESS_LEVEL = int(os.environ.get("IMAGEDIFF_PNG_COMPRESS_LEVEL", "1"))
+# Sparse diffs ship the changed DIFF_TILE_SIZE x DIFF_TILE_SIZE tiles of a frame
+DIFF_TILE_SIZE = int(os.environ.get("IMAGEDIFF_DIFF_TILE_SIZE", "64"))
+# Cache-Control max-age of screenshot and diff image responses; uploaded builds never change
+IMAGE_CACHE_MAX_AGE = int(os.environ.get("IMAGEDIFF_IMAGE_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+
+# Build columns the target page loads at a time, 0 loads every build at once
+TARGET_BUILD_WINDOW = int(os.environ.get("IMAGEDIFF_TARGET_BUILD_WINDOW", "10"))
+
+# Downscaled previews of frames and diff images, stored by content digest
+THUMBNAIL_DIR = os.environ.get("IMAGEDIFF_THUMBNAIL_DIR", os.path.join(SCREENSHOTS_DIR, ".imagediff-thumbs"))
+THUMBNAIL_SIZES = tuple(int(size) for size in os.environ.get("IMAGEDIFF_THUMBNAIL_SIZES", "128,512").split(","))
+# Preview size used by the compare and view pages
+THUMBNAIL_PREVIEW_SIZE = int(os.environ.get("IMAGEDIFF_THUMBNAIL_PREVIEW_SIZE", "512"))
+THUMBNAIL_FORMAT = os.environ.get("IMAGEDIFF_THUMBNAIL_FORMAT", "WEBP").upper()
+THUMBNAIL_QUALITY = int(os.environ.get("IMAGEDIFF_THUMBNAIL_QUALITY", "80"))
+
+# Check cached low-resolution signatures before decoding full frames
+DIFF_COARSE = os.environ.get("IMAGEDIFF_COARSE", "0") not in ("", "0", "false", "no")
+# Signatures hold the pixel sums of SIGNATURE_GRID x SIGNATURE_GRID blocks of a frame
+SIGNATURE_GRID = int(os.environ.get("IMAGEDIFF_SIGNATURE_GRID", "16"))
+
+# Decoded pixel memory in MB one process may hold at once, 0 disables the limit.
+# Decodes wait for memory instead of piling up under concurrent requests.
+DECODE_MEMORY_BUDGET = int(os.environ.get("IMAGEDIFF_DECODE_BUDGET_MB", "512")) * 1024 * 1024
+# Work arrays in MB kept for reuse between frame comparisons
+DECODE_POOL_SIZE = int(os.environ.get("IMAGEDIFF_DECODE_POOL_MB", "64")) * 1024 * 1024
+# Decoded frames are kept as memory-mapped raw RGB files, up to FRAME_STORE_BUDGET MB; 0 disables the store
+FRAME_STORE_DIR = os.environ.get("IMAGEDIFF_FRAME_STORE_DIR", os.path.join(SCREENSHOTS_DIR, ".imagediff-frames"))
+FRAME_STORE_BUDGET = int(os.environ.get("IMAGEDIFF_FRAME_STORE_MB", "0")) * 1024 * 1024
+
+# Regions of interest and ignore masks per target and movie, see masks.load_mask_rules
+MASKS_FILE = os.environ.get("IMAGEDIFF_MASKS", os.path.join(SCREENSHOTS_DIR, ".imagediff-masks.json"))
+
+# Slow views (movie, build and target matrix) computed at once, leaving the other server threads to cheap routes
+HEAVY_WORKERS = int(os.environ.get("IMAGEDIFF_HEAVY_WORKERS", "2"))
+# Seconds a slow view waits for its background job before answering with the job's progress
+JOB_WAIT = float(os.environ.get("IMAGEDIFF_JOB_WAIT", "5"))
+# Finished jobs kept for reuse by later viewers
+JOB_HISTORY = int(os.environ.get("IMAGEDIFF_JOB_HISTORY", "64"))
+
+# Add a Server-Timing header with the time spent in each stage to every response
+SERVER_TIMING = os.environ.get("IMAGEDIFF_SERVER_TIMING", "0") not in ("", "0", "false", "no")
+# Let ?profile=1 answer a request with a sampling profile of the server instead of its response
+PROFILING = os.environ.get("IMAGEDIFF_PROFILING", "0") not in ("", "0", "false", "no")
+PROFILE_INTERVAL = float(os.environ.get("IMAGEDIFF_PROFILE_INTERVAL", "0.005"))
@@ -0,0 +1,111 @@
+import threading
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
+from PIL import Image
+
+from imagediff2.config import DECODE_MEMORY_BUDGET, DECODE_POOL_SIZE
+from imagediff2.metrics import timed
+
+def decoded_bytes(image):
+    """Memory a lazily opened image will hold once loaded; PIL keeps multi-band pixels in 4 bytes."""
+    width, height = image.size
+    return width * height * (1 if image.mode in ('1', 'L', 'P') else 4)
+
+class MemoryBudget:
+    """
+    Bytes of decoded pixels a process may hold at once.
+
+    reserve() blocks until the reservation fits in the budget. A reservation
+    larger than the whole budget is still granted once nothing else is in
+    flight, so a single oversized frame slows decoding down instead of failing.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self.waits = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        with self._cond:
+            if self.limit and self.in_flight and self.in_flight + nbytes > self.limit:
+                self.waits += 1
+                self._cond.wait_for(lambda: not self.in_flight or self.in_flight + nbytes <= self.limit)
+            self.in_flight += nbytes
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= nbytes
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'budget': self.limit, 'in_flight': self.in_flight, 'peak': self.peak, 'waits': self.waits}
+
+class BufferPool:
+    """
+    Free list of NumPy work arrays reused between comparisons.
+
+    Frames of a movie usually share one resolution, so the arrays of the
+    previous comparison fit the next one. At most max_bytes are kept.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.pooled = 0
+        self._free = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def array(self, shape, dtype):
+        """Lend an uninitialized array of shape and dtype, returned to the pool on exit."""
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            free = self._free.get(key)
+            buffer = free.pop() if free else None
+            if buffer is not None:
+                self.pooled -= buffer.nbytes
+        if buffer is None:
+            buffer = np.empty(key[0], dtype=key[1])
+        try:
+            yield buffer
+        finally:
+            with self._lock:
+                if self.pooled + buffer.nbytes <= self.max_bytes:
+                    self._free.setdefault(key, []).append(buffer)
+                    self.pooled += buffer.nbytes
+
+    def stats(self):
+        with self._lock:
+            return {'pooled': self.pooled, 'max': self.max_bytes}
+
+decode_budget = MemoryBudget(DECODE_MEMORY_BUDGET)
+buffer_pool = BufferPool(DECODE_POOL_SIZE)
+
+@contextmanager
+def open_images(*paths, size=None, copies=1):
+    """
+    Open images for decoding under the memory budget and close them on exit.
+
+    Images are opened lazily, so only their headers are read before the
+    budget is reserved. copies is the number of full-size images or arrays
+    the caller derives from each one, counting itself. With size, formats
+    that support it (JPEG) decode at a reduced resolution of at least size.
+    """
+    with ExitStack() as stack:
+        images = [stack.enter_context(Image.open(path)) for path in paths]
+        if size is not None:
+            for image in images:
+                image.draft('RGB', size)
+        with timed('decode_wait'):
+            stack.enter_context(decode_budget.reserve(copies * sum(decoded_bytes(image) for image in images)))
+        yield images
+
+def decode_stats():
+    """Bytes of decoded pixels in flight and pooled in this process."""
+    return {**decode_budget.stats(), 'pool': buffer_pool.stats()}
@@ -0,0 +1,127 @@
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from imagediff2.config import DIFF_WORKERS
+from imagediff2.metrics import collecting, merge
+
+# Pairs queued per worker, so cancelling after an early verdict wastes little work
+QUEUE_DEPTH = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """
+    Return the shared frame comparison pool, or None when comparing inline.
+
+    Workers are started from a fork server (or spawned where there is none)
+    rather than forked from the server process, whose other threads may
+    hold locks at that moment.
+    """
+    global _executor
+    if DIFF_WORKERS <= 1:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _executor = ProcessPoolExecutor(max_workers=DIFF_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _executor
+
+def discard_executor(executor):
+    """Drop a broken pool, so the next comparison starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def compare_frame_pairs(pairs, compare, stop_on_diff=False):
+    """
+    Run compare(src_path, cmp_path) over frame pairs on the worker pool.
+
+    Yields (pair, result) as each comparison finishes, in completion order.
+    result is None if the comparison raised. With stop_on_diff, iteration
+    ends after the first result reporting has_diff; closing the generator
+    early cancels every comparison that has not started yet.
+
+    If a worker dies (killed for memory, for example), the pool is
+    discarded and the pairs without a result are compared inline.
+    """
+    executor = get_executor()
+    pairs = iter(pairs)
+
+    if executor is None:
+        yield from _compare_inline(pairs, compare, stop_on_diff)
+        return
+
+    pending = {}
+    # Pairs taken from pairs whose comparison was lost with the pool
+    lost = []
+
+    def submit(count):
+        for pair in itertools.islice(pairs, count):
+            try:
+                pending[executor.submit(_collect, compare, pair)] = pair
+            except BrokenProcessPool:
+                lost.append(pair)
+                raise
+
+    try:
+        submit(DIFF_WORKERS * QUEUE_DEPTH)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pair = pending.pop(future)
+                try:
+                    result, samples = future.result()
+                    merge(samples)
+                except BrokenProcessPool:
+                    lost.append(pair)
+                    raise
+                except Exception as e:
+                    print(f"Error comparing frames {pair[0]} and {pair[1]}: {e}")
+                    result = None
+
+                yield pair, result
+                if stop_on_diff and (result is None or result.get('has_diff', False)):
+                    return
+            submit(len(done))
+    except BrokenProcessPool as e:
+        print(f"Frame comparison pool broken, comparing the remaining frames inline: {e}")
+        discard_executor(executor)
+        remaining = itertools.chain(lost, list(pending.values()), pairs)
+        pending.clear()
+        yield from _compare_inline(remaining, compare, stop_on_diff)
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _compare_inline(pairs, compare, stop_on_diff):
+    for pair in pairs:
+        result = _run(compare, pair)
+        yield pair, result
+        if stop_on_diff and (result is None or result.get('has_diff', False)):
+            return
+
+def _collect(compare, pair):
+    """Run a comparison in a worker process, returning the metrics it recorded with its result."""
+    with collecting() as samples:
+        result = compare(*pair)
+    return result, samples
+
+def _run(compare, pair):
+    try:
+        return compare(*pair)
+    except Exception as e:
+        print(f"Error comparing frames {pair[0]} and {pair[1]}: {e}")
+        return None
+
+def any_frame_differs(pairs, compare):
+    """Tell whether any frame pair differs, stopping at the first difference."""
+    for _, result in compare_frame_pairs(pairs, compare, stop_on_diff=True):
+        if result is None or result.get('has_diff', False):
+            return True
+    return False
@@ -0,0 +1,32 @@
+import hashlib
+
+from imagediff2.cache import diff_cache, file_identity
+
+CHUNK_SIZE = 1024 * 1024
+
+def hash_file(path):
+    """Stream a file through BLAKE2b and return its hex digest."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_fingerprint(path, identity=None):
+    """
+    Return the content digest of a screenshot.
+
+    Digests are remembered in the diff cache under the file identity, so
+    each file is read at most once until it changes on disk. Callers that
+    already stat'ed the file can pass its identity to skip another stat.
+    """
+    key = identity or file_identity(path)
+    digest = diff_cache.get_digest(key)
+    if digest is None:
+        digest = hash_file(path)
+        diff_cache.put_digest(key, digest)
+    return digest
+
+def files_identical(src_path, cmp_path):
+    """Tell whether two files have byte-for-byte identical content."""
+    return file_fingerprint(src_path) == file_fingerprint(cmp_path)
@@ -0,0 +1,137 @@
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from PIL import Image
+
+from imagediff2.config import FRAME_STORE_DIR, FRAME_STORE_BUDGET
+from imagediff2.decode import open_images
+from imagediff2.fingerprint import file_fingerprint
+from imagediff2.metrics import count_cache_lookup, timed
+
+# Modes whose RGB pixels decide every comparison the same way the decoded image does
+STORED_MODES = ('RGB', 'RGBA', 'L')
+
+# pixels is a read-only (height, width, 3) uint8 view of the mapped file; mode is the mode of the source image
+StoredFrame = namedtuple('StoredFrame', ['mode', 'size', 'pixels'])
+
+class FrameStore:
+    """
+    Decoded RGB pixels of frames kept in memory-mapped files.
+
+    Files are keyed on the content digest of the frame, so a frame is
+    inflated once however many builds share it and however many times it is
+    compared, and every comparison reads it as a zero-copy array. The least
+    recently used files are deleted once they exceed max_bytes; 0 disables
+    the store.
+
+    Frames are filled by every worker process, so each fill re-scans the
+    directory and the budget holds for the files of all processes. Files
+    this process used come last, the others in the order they were written.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stored = 0
+        self._files = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def frame_path(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.raw")
+
+    def _load(self):
+        """Index the files on disk, oldest first, but those this process used last."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.raw'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, path, st.st_size))
+        used = self._files or ()
+        self._files = OrderedDict((path, size) for _, path, size in sorted(files))
+        for path in used:
+            if path in self._files:
+                self._files.move_to_end(path)
+        self.stored = sum(self._files.values())
+
+    def _touch(self, path, nbytes):
+        """Mark a stored file as used, returning False if it is missing or incomplete."""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+        with self._lock:
+            if self._files is None:
+                self._load()
+            if size != nbytes:
+                self.stored -= self._files.pop(path, 0)
+                return False
+            if path not in self._files:
+                self._files[path] = nbytes
+                self.stored += nbytes
+            self._files.move_to_end(path)
+            return True
+
+    def _add(self, path, nbytes):
+        with self._lock:
+            self._load()
+            if path in self._files:
+                self._files.move_to_end(path)
+            while self.stored > self.max_bytes and len(self._files) > 1:
+                evicted, size = self._files.popitem(last=False)
+                self.stored -= size
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+
+    def get(self, image_path):
+        """
+        Return the StoredFrame of an image, decoding it into the store on first use.
+
+        Returns None when the store is disabled, for empty frames and for
+        modes outside STORED_MODES, which are left to a regular decode.
+        """
+        if not self.enabled:
+            return None
+
+        with Image.open(image_path) as image:
+            mode, size = image.mode, image.size
+        nbytes = size[0] * size[1] * 3
+        if mode not in STORED_MODES or not nbytes:
+            return None
+
+        path = self.frame_path(file_fingerprint(image_path))
+        hit = self._touch(path, nbytes)
+        count_cache_lookup('frame_store', hit)
+        if not hit:
+            with timed('frame_store_fill'), open_images(image_path, copies=2) as (image,):
+                pixels = np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                pixels.tofile(tmp_path)
+                os.replace(tmp_path, path)
+            self._add(path, nbytes)
+
+        try:
+            pixels = np.memmap(path, dtype=np.uint8, mode='r', shape=(size[1], size[0], 3))
+        except (OSError, ValueError):
+            # Evicted by another process in the meantime
+            return None
+        return StoredFrame(mode, size, pixels)
+
+    def stats(self):
+        with self._lock:
+            return {'stored': self.stored, 'files': len(self._files or ()), 'budget': self.max_bytes}
+
+frame_store = FrameStore(FRAME_STORE_DIR, FRAME_STORE_BUDGET)
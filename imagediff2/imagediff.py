@@ -1,36 +1,255 @@
 from PIL import Image, ImageChops
 import os
 import base64
+import hashlib
+import json
+import math
+import threading
+from functools import partial
 from io import BytesIO
-from imagediff2.config import SCREENSHOTS_DIR
+import numpy as np
+from imagediff2.config import SCREENSHOTS_DIR, DIFF_IMAGE_DIR, DIFF_IMAGE_FORMAT, PNG_COMPRESS_LEVEL, DIFF_TILE_SIZE
+from imagediff2.decode import open_images
+from imagediff2.cache import diff_cache, frame_key, movie_key
+from imagediff2.fingerprint import files_identical
+from imagediff2.manifest import get_manifest, frame_number
+from imagediff2.engine import any_frame_differs
+from imagediff2.framestore import StoredFrame, frame_store
+from imagediff2.kernel import diff_stats, exact_bbox, masked_options, options_variant, uses_numpy
+from imagediff2.metrics import timed, timed_stage
+from imagediff2.signatures import EXACT_MODES, coarse_differs, load_signature, store_signature
 
-def encode_image(image):
-    """Encode an image to a base64 string."""
-    buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+IMAGE_MIMETYPES = {'PNG': 'image/png', 'WEBP': 'image/webp'}
+IMAGE_EXTENSIONS = {'PNG': 'png', 'WEBP': 'webp'}
 
-def image_diff(src_img_path, cmp_img_path):
+_buffers = threading.local()
+
+def save_options(format):
+    """Fastest lossless encoder settings of a format."""
+    if format == 'WEBP':
+        return {'lossless': True, 'quality': 0, 'method': 0}
+    return {'compress_level': PNG_COMPRESS_LEVEL}
+
+def diff_image_mimetype():
+    return IMAGE_MIMETYPES[DIFF_IMAGE_FORMAT]
+
+@timed_stage('encode_image')
+def encode_image(image, format="PNG"):
     """
-    Compute the difference between two images and return the results.
+    Encode an image to a base64 string.
+
+    Images are encoded with the fast settings of save_options into a
+    per-thread buffer that is overwritten rather than reallocated.
     """
-    try:
-        src_img = Image.open(src_img_path)
-        cmp_img = Image.open(cmp_img_path)
-        diff_img = ImageChops.difference(src_img, cmp_img).convert('RGB')
+    buffered = getattr(_buffers, 'buffer', None)
+    if buffered is None:
+        buffered = _buffers.buffer = BytesIO()
+    buffered.seek(0)
+    image.save(buffered, format=format, **save_options(format))
+    with buffered.getbuffer() as data:
+        return base64.b64encode(data[:buffered.tell()]).decode('utf-8')
+
+def diff_file_path(cache_key, extension):
+    """Path of a file rendered from the frame pair of cache_key."""
+    name = hashlib.blake2b(cache_key.encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(DIFF_IMAGE_DIR, name[:2], f"{name}.{extension}")
+
+def write_diff_file(path, write):
+    """Write a rendered file atomically with write(tmp_path)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
 
-        has_diff = diff_img.getbbox() is not None
+def changed_box(src_img, cmp_img, cache_key):
+    """
+    Bbox of the pixels that differ between two decoded frames, None if there are none.
+
+    The bbox of the cached exact verdict is used when PIL would find the
+    same one. Otherwise the frames are diffed in full and the verdict cached.
+    """
+    verdict = diff_cache.get_frame(cache_key)
+    if (verdict is not None and (verdict['bbox'] or not verdict['has_diff']) and src_img.size == cmp_img.size
+            and src_img.mode == cmp_img.mode and src_img.mode in EXACT_MODES):
+        return tuple(verdict['bbox']) if verdict['bbox'] else None
+
+    bbox = ImageChops.difference(src_img, cmp_img).convert('RGB').getbbox()
+    diff_cache.put_frame(cache_key, {'has_diff': bbox is not None, 'bbox': bbox})
+    return bbox
 
-        return {
-            'src_img_data': encode_image(src_img),
-            'cmp_img_data': encode_image(cmp_img),
-            'diff_img_data': encode_image(diff_img) if has_diff else None,
-            'has_diff': has_diff
+def diff_image_file(src_img_path, cmp_img_path):
+    """
+    Render the difference image of two frames to a file and return its path.
+
+    Files are named after the identity of both frames and reused until
+    either frame changes, so each diff is rendered once. Only the changed
+    region is diffed and the rest of the image is left black, which also
+    keeps the encoded file small.
+    """
+    cache_key = frame_key(src_img_path, cmp_img_path)
+    diff_path = diff_file_path(cache_key, IMAGE_EXTENSIONS[DIFF_IMAGE_FORMAT])
+    if os.path.exists(diff_path):
+        return diff_path
+
+    with timed('diff_image'), open_images(src_img_path, cmp_img_path, copies=2) as (src_img, cmp_img):
+        box = changed_box(src_img, cmp_img, cache_key)
+        diff_img = Image.new('RGB', src_img.size)
+        if box:
+            diff_img.paste(ImageChops.difference(src_img.crop(box), cmp_img.crop(box)).convert('RGB'), box[:2])
+
+        write_diff_file(diff_path, partial(diff_img.save, format=DIFF_IMAGE_FORMAT, **save_options(DIFF_IMAGE_FORMAT)))
+    return diff_path
+
+def diff_tiles(src_img, cmp_img, box, tile_size=DIFF_TILE_SIZE):
+    """
+    Sparse difference of two decoded frames: the tiles of a tile_size grid
+    that contain changed pixels, with their difference pixels.
+
+    Only the tiles covering box are diffed. The changed tiles are packed
+    row by row into an atlas of 'columns' tiles per row, so the size of
+    the result follows the size of the change rather than of the frame.
+    """
+    width, height = src_img.size
+    result = {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'bbox': box,
+        'tiles': [],
+        'columns': 0,
+        'atlas': None,
+        'stats': {
+            'changed_pixels': 0,
+            'changed_tiles': 0,
+            'total_tiles': math.ceil(width / tile_size) * math.ceil(height / tile_size),
+            'max_delta': 0
         }
+    }
+    if not box:
+        return result
+
+    # Grow the bbox to whole tiles, clipped to the frame
+    left, top = box[0] // tile_size * tile_size, box[1] // tile_size * tile_size
+    right, bottom = min(-(-box[2] // tile_size) * tile_size, width), min(-(-box[3] // tile_size) * tile_size, height)
+    region = (left, top, right, bottom)
+    region_diff = ImageChops.difference(src_img.crop(region), cmp_img.crop(region)).convert('RGB')
+    delta = np.asarray(region_diff)
+    changed = delta.any(axis=2)
+
+    tiles = []
+    for y in range(0, bottom - top, tile_size):
+        for x in range(0, right - left, tile_size):
+            count = int(changed[y:y + tile_size, x:x + tile_size].sum())
+            if count:
+                tiles.append((x, y, min(tile_size, right - left - x), min(tile_size, bottom - top - y), count))
+
+    columns = math.ceil(math.sqrt(len(tiles)))
+    atlas = Image.new('RGB', (columns * tile_size, math.ceil(len(tiles) / columns) * tile_size))
+    for index, (x, y, w, h, count) in enumerate(tiles):
+        atlas.paste(region_diff.crop((x, y, x + w, y + h)),
+                    (index % columns * tile_size, index // columns * tile_size))
+
+    result['tiles'] = [[left + x, top + y, w, h] for x, y, w, h, count in tiles]
+    result['columns'] = columns
+    result['atlas'] = encode_image(atlas)
+    result['stats'].update({
+        'changed_pixels': sum(tile[4] for tile in tiles),
+        'changed_tiles': len(tiles),
+        'max_delta': int(delta.max())
+    })
+    return result
+
+def diff_tiles_file(src_img_path, cmp_img_path):
+    """
+    Render the sparse difference of two frames (see diff_tiles) to a JSON
+    file and return its path. Files are reused like those of diff_image_file.
+    """
+    cache_key = frame_key(src_img_path, cmp_img_path)
+    tiles_path = diff_file_path(cache_key, 'tiles.json')
+    if os.path.exists(tiles_path):
+        return tiles_path
+
+    with timed('diff_tiles'), open_images(src_img_path, cmp_img_path, copies=2) as (src_img, cmp_img):
+        tiles = diff_tiles(src_img, cmp_img, changed_box(src_img, cmp_img, cache_key))
+
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(tiles, f)
+
+    write_diff_file(tiles_path, write)
+    return tiles_path
+
+@timed_stage('frames_differ')
+def frames_differ(src_img_path, cmp_img_path, options=None):
+    """
+    Decide whether two frames differ without encoding any image data.
+
+    Returns a dict with 'has_diff' and the 'bbox' of the changed region,
+    or an empty dict if either image cannot be read. Verdicts are kept in
+    the persistent diff cache, and byte-identical files are reported as
+    identical without decoding any pixels. options (DiffOptions) selects
+    the kernel and tolerances, exact PIL comparison by default.
+
+    With options.coarse, cached signatures of both frames are compared
+    first and a clear difference is reported without decoding either frame.
+    Such a verdict is cached without a bbox; diff images and tiles then
+    find the changed region themselves.
+
+    When the frame store is enabled, frames are compared as arrays mapped
+    from the store, so each frame is only inflated once.
+    """
+    try:
+        cache_key = frame_key(src_img_path, cmp_img_path, options_variant(options))
+        cached = diff_cache.get_frame(cache_key)
+        if cached is not None:
+            return cached
+
+        if files_identical(src_img_path, cmp_img_path):
+            result = {'has_diff': False, 'bbox': None}
+        else:
+            coarse = options is not None and options.coarse
+            if coarse and coarse_differs(src_img_path, cmp_img_path, options):
+                result = {'has_diff': True, 'bbox': None}
+            else:
+                result = decode_verdict(src_img_path, cmp_img_path, options)
+
+        diff_cache.put_frame(cache_key, result)
+        return result
     except IOError:
         return {}
 
-def movie_diff(src_build, cmp_build, target, movie):
+def decode_verdict(src_img_path, cmp_img_path, options):
+    """Decode two frames, from the frame store when it has both, and compare them."""
+    src_frame, cmp_frame = frame_store.get(src_img_path), frame_store.get(cmp_img_path)
+    if (src_frame is not None and cmp_frame is not None
+            and (uses_numpy(options) or src_frame.mode == cmp_frame.mode)):
+        with timed('diff_kernel'):
+            return frame_verdict(src_img_path, cmp_img_path, src_frame, cmp_frame, options)
+
+    copies = 3 if uses_numpy(options) else 2
+    with timed('diff_kernel'), open_images(src_img_path, cmp_img_path, copies=copies) as images:
+        return frame_verdict(src_img_path, cmp_img_path, *images, options)
+
+def frame_verdict(src_img_path, cmp_img_path, src_img, cmp_img, options):
+    """Verdict of two decoded frames for frames_differ; both may be StoredFrames."""
+    if options is not None and options.coarse:
+        # Decoded anyway, so the next comparison of either frame can use its signature
+        for path, img in ((src_img_path, src_img), (cmp_img_path, cmp_img)):
+            if load_signature(path) is None:
+                store_signature(path, img)
+
+    if uses_numpy(options):
+        stats = diff_stats(src_img, cmp_img, options)
+        return {'has_diff': stats['has_diff'], 'bbox': stats['bbox']}
+
+    if isinstance(src_img, StoredFrame):
+        bbox = exact_bbox(src_img, cmp_img)
+    else:
+        bbox = ImageChops.difference(src_img, cmp_img).convert('RGB').getbbox()
+    return {'has_diff': bbox is not None, 'bbox': bbox}
+
+@timed_stage('movie_diff')
+def movie_diff(src_build, cmp_build, target, movie, options=None):
     """
     Compare all frames of a movie between two builds and determine if there are any differences.
 
@@ -39,63 +258,53 @@ def movie_diff(src_build, cmp_build, target, movie):
         cmp_build (str): The comparison build name
         target (str): The target name
         movie (str): The movie name
+        options (DiffOptions): Kernel and tolerances, exact comparison if None.
+            The mask of the movie, if any, is applied on top.
 
     Returns:
         bool: True if any frame has differences, False otherwise
     """
     src_build_path = os.path.join(SCREENSHOTS_DIR, target, src_build)
     cmp_build_path = os.path.join(SCREENSHOTS_DIR, target, cmp_build)
+    options = masked_options(options, target, movie)
 
     # Ensure both build paths exist
-    if not os.path.exists(src_build_path) or not os.path.exists(cmp_build_path):
+    try:
+        cache_key = movie_key(src_build_path, cmp_build_path, movie, options_variant(options))
+    except OSError:
         return False
 
-    # Get all frames for this movie in both builds
-    src_frames = [f for f in os.listdir(src_build_path)
-                  if os.path.isfile(os.path.join(src_build_path, f)) and f.startswith(f"{movie}-")]
+    cached = diff_cache.get_movie(cache_key)
+    if cached is not None:
+        return cached
 
-    cmp_frames = [f for f in os.listdir(cmp_build_path)
-                  if os.path.isfile(os.path.join(cmp_build_path, f)) and f.startswith(f"{movie}-")]
+    has_diff = _movie_diff_uncached(src_build_path, cmp_build_path, movie, options)
+    diff_cache.put_movie(cache_key, has_diff)
+    return has_diff
+
+def _movie_diff_uncached(src_build_path, cmp_build_path, movie, options):
+    """Frame-by-frame comparison behind movie_diff."""
+    # Get all frames for this movie in both builds
+    src_frames = get_manifest(src_build_path).frames(movie)
+    cmp_frames = get_manifest(cmp_build_path).frames(movie)
 
     # If frame counts differ, there's definitely a difference
     if len(src_frames) != len(cmp_frames):
         return True
 
-    # Helper function to extract frame number from filename
-    def get_frame_number(filename):
-        parts = filename.split('-')
-        if len(parts) > 1:
-            try:
-                return int(parts[1].split('.')[0])
-            except ValueError:
-                return 0
-        return 0
-
-    src_frame_map = {get_frame_number(f): f for f in src_frames}
-    cmp_frame_map = {get_frame_number(f): f for f in cmp_frames}
-
-    all_frame_numbers = sorted(set(list(src_frame_map.keys()) + list(cmp_frame_map.keys())))
+    src_frame_map = {frame_number(frame): entry.filename for frame, entry in src_frames.items()}
+    cmp_frame_map = {frame_number(frame): entry.filename for frame, entry in cmp_frames.items()}
 
     if set(src_frame_map.keys()) != set(cmp_frame_map.keys()):
         return True
 
-    for frame_num in all_frame_numbers:
-        src_frame = src_frame_map.get(frame_num)
-        cmp_frame = cmp_frame_map.get(frame_num)
+    pairs = [(os.path.join(src_build_path, src_frame_map[frame_num]),
+              os.path.join(cmp_build_path, cmp_frame_map[frame_num]))
+             for frame_num in sorted(src_frame_map.keys())]
 
-        if src_frame and cmp_frame:
-            src_img_path = os.path.join(src_build_path, src_frame)
-            cmp_img_path = os.path.join(cmp_build_path, cmp_frame)
-
-            try:
-                diff_result = image_diff(src_img_path, cmp_img_path)
-
-                if diff_result.get('has_diff', False):
-                    return True
-            except Exception as e:
-                print(f"Error comparing frames {src_frame} and {cmp_frame}: {e}")
-                return True
-        else:
+    # Signatures are a few KB per frame, so sweep them all before decoding any frame
+    if options is not None and options.coarse:
+        if any(not files_identical(src, cmp) and coarse_differs(src, cmp, options) for src, cmp in pairs):
             return True
 
-    return False
\ No newline at end of file
+    return any_frame_differs(pairs, partial(frames_differ, options=options))
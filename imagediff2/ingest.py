@@ -0,0 +1,126 @@
+"""
+Precompute diff verdicts for newly uploaded builds.
+
+Run once with `python -m imagediff2.ingest`, or keep it running with
+`--watch` next to the web server. Every build that has not been ingested
+yet is compared against its predecessor, so the routes only read the
+persistent diff cache.
+"""
+import argparse
+import os
+import time
+from functools import partial
+
+from imagediff2.config import SCREENSHOTS_DIR
+from imagediff2.cache import diff_cache, file_identity
+from imagediff2.engine import compare_frame_pairs
+from imagediff2.imagediff import frames_differ, movie_diff
+from imagediff2.kernel import make_diff_options, masked_options
+from imagediff2.manifest import get_manifest, list_subdirs, sorted_builds
+from imagediff2.reports import update_movie_histories
+from imagediff2.signatures import get_signature
+from imagediff2.thumbnails import generate_thumbnails
+
+def previous_build_with_movie(manifests, builds, index, movie):
+    """Return the closest older build than builds[index] containing movie."""
+    for build in builds[index + 1:]:
+        if manifests[build].has_movie(movie):
+            return build
+    return None
+
+def ingest_build(target, builds, index, manifests, options, thumbnails=False):
+    """
+    Precompute the verdicts the routes need for builds[index].
+
+    builds is ordered newest first, like get_sorted_builds, so the
+    predecessor of a build is the next entry.
+    """
+    build = builds[index]
+    prev_build = builds[index + 1] if index < len(builds) - 1 else None
+    manifest = manifests[build]
+
+    if thumbnails:
+        for filename in manifest.all_files():
+            generate_thumbnails(os.path.join(manifest.path, filename))
+
+    if options.coarse:
+        # Signatures are stored with the build so later comparisons can skip decoding
+        for filename in manifest.all_files():
+            try:
+                get_signature(os.path.join(manifest.path, filename))
+            except OSError as e:
+                print(f"Error computing signature of {filename}: {e}")
+
+    for movie in sorted(manifest.movie_names()):
+        # Target matrix and /build/<build> compare against the predecessor
+        if prev_build:
+            movie_diff(build, prev_build, target, movie, options)
+
+        # /movie/<movie> and re-added movies compare against the last build containing the movie
+        ref_build = previous_build_with_movie(manifests, builds, index, movie)
+        if ref_build is None:
+            continue
+        if ref_build != prev_build:
+            movie_diff(build, ref_build, target, movie, options)
+
+        frames = manifest.frames(movie)
+        ref_frames = manifests[ref_build].frames(movie)
+        if frames.keys() != ref_frames.keys():
+            # Partial comparisons check every common frame on their own
+            pairs = [(manifest.frame_path(movie, frame), manifests[ref_build].frame_path(movie, frame))
+                     for frame in frames.keys() & ref_frames.keys()]
+            compare = partial(frames_differ, options=masked_options(options, target, movie))
+            for _ in compare_frame_pairs(pairs, compare):
+                pass
+
+def ingest_target(target, options, thumbnails=False):
+    """Ingest every build of a target that changed since it was last ingested."""
+    target_path = os.path.join(SCREENSHOTS_DIR, target)
+    builds = sorted_builds(target_path)
+    manifests = {}
+    ingested = 0
+
+    # Oldest first, so a nightly build is always compared against an ingested predecessor
+    for index in reversed(range(len(builds))):
+        build_path = os.path.join(target_path, builds[index])
+        key = file_identity(build_path)
+        if diff_cache.is_ingested(key):
+            continue
+
+        if not manifests:
+            manifests = {build: get_manifest(os.path.join(target_path, build)) for build in builds}
+
+        start = time.time()
+        ingest_build(target, builds, index, manifests, options, thumbnails)
+        diff_cache.mark_ingested(key)
+        ingested += 1
+        print(f"Ingested {target}/{builds[index]} in {time.time() - start:.1f}s")
+
+    # /movie/<movie> reads these, extended here with the new builds only
+    if ingested:
+        update_movie_histories(target, options)
+
+    return ingested
+
+def ingest_all(options, targets=None, thumbnails=False):
+    """Ingest every target, or only the given ones."""
+    return sum(ingest_target(target, options, thumbnails) for target in (targets or list_subdirs(SCREENSHOTS_DIR)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute diff verdicts for new builds.")
+    parser.add_argument('targets', nargs='*', help="targets to ingest, all by default")
+    parser.add_argument('--watch', action='store_true', help="keep polling for new builds")
+    parser.add_argument('--interval', type=float, default=60, help="seconds between two polls in watch mode")
+    parser.add_argument('--thumbnails', action='store_true', help="also render the thumbnails of every frame")
+    parser.add_argument('--coarse', action='store_true', help="store frame signatures and use them to compare")
+    args = parser.parse_args()
+
+    options = make_diff_options(coarse=True if args.coarse else None)
+    while True:
+        ingest_all(options, args.targets, args.thumbnails)
+        if not args.watch:
+            break
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from itertools import islice
+
+from imagediff2.config import SCREENSHOTS_DIR, MASKS_FILE
+from imagediff2.cache import file_identity
+from imagediff2.manifest import list_subdirs
+
+_current = threading.local()
+
+class Job:
+    """
+    A slow computation running in the background, with its progress and
+    the partial results reported until it finishes.
+
+    Streaming jobs also keep the chunks of output they produced, so any
+    number of viewers can attach and follow them. The output is released
+    once the job finished and its last viewer detached; the job is then no
+    longer reused.
+    """
+
+    def __init__(self, kind, key, fingerprint):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.fingerprint = fingerprint
+        self.status = 'queued'
+        self.done = 0
+        self.total = None
+        self.partial = {}
+        self.result = None
+        self.exception = None
+        self.output = []
+        self.readers = 0
+        self.followed = False
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+        self._lock = threading.Condition()
+
+    def report(self, done=None, total=None, partial=None):
+        with self._lock:
+            if done is not None:
+                self.done = done
+            if total is not None:
+                self.total = total
+            if partial:
+                self.partial.update(partial)
+
+    def write(self, chunk):
+        with self._lock:
+            self.output.append(chunk)
+            self._lock.notify_all()
+
+    def finish(self):
+        with self._lock:
+            self.finished = time.time()
+            # The result holds everything the partial results did
+            self.partial = {}
+            self._release_output()
+            self._lock.notify_all()
+
+    def attach(self):
+        """Register a viewer of the output, returning False once the output was released."""
+        with self._lock:
+            if self.output is None:
+                return False
+            self.readers += 1
+            self.followed = True
+            return True
+
+    def detach(self):
+        with self._lock:
+            self.readers -= 1
+            self._release_output()
+
+    def _release_output(self):
+        if self.finished is not None and self.followed and not self.readers:
+            self.output = None
+
+    def wait_for_output(self, timeout=None):
+        """Wait until the job produced output or finished, at most timeout seconds."""
+        with self._lock:
+            self._lock.wait_for(lambda: self.output or self.finished is not None, timeout)
+
+    def follow(self):
+        """
+        Yield the output of the job from its start, waiting for more until
+        the job finishes. The caller must be attached.
+        """
+        position = 0
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: len(self.output) > position or self.finished is not None)
+                chunks = self.output[position:]
+                finished = self.finished is not None
+            yield from chunks
+            position += len(chunks)
+            if finished:
+                return
+
+    def to_dict(self, partial_since=None):
+        """Status of the job, with the partial results reported after the first partial_since, if given."""
+        with self._lock:
+            data = {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'done': self.done,
+                'total': self.total,
+                'created': self.created,
+                'finished': self.finished,
+                'error': str(self.exception) if self.exception is not None else None,
+                'partial_count': len(self.partial)
+            }
+            if partial_since is not None:
+                data['partial'] = dict(islice(self.partial.items(), max(partial_since, 0), None))
+        return data
+
+class JobQueue:
+    """
+    In-process queue of background jobs.
+
+    A job is identified by its kind and key (the request it answers). While
+    the screenshots it depends on keep the same fingerprint, submitting the
+    same job again returns the running or finished one, so concurrent and
+    later viewers share a single computation. At most history jobs are kept.
+    """
+
+    def __init__(self, get_executor, history):
+        self.get_executor = get_executor
+        self.history = history
+        self.reused = 0
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, key, fingerprint, func):
+        """Return the reusable job for (kind, key), starting func as a new job if there is none."""
+        with self._lock:
+            job = self._by_key.get((kind, key))
+            if (job is not None and job.fingerprint == fingerprint and job.status != 'failed'
+                    and job.output is not None):
+                self._jobs.move_to_end(job.id)
+                self.reused += 1
+                return job
+
+            job = Job(kind, key, fingerprint)
+            self._jobs[job.id] = job
+            self._by_key[(kind, key)] = job
+            job.future = self.get_executor().submit(self._run, job, func)
+            self._trim()
+        return job
+
+    def _trim(self):
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.history:
+                break
+            job = self._jobs[job_id]
+            if job.status in ('done', 'failed'):
+                del self._jobs[job_id]
+                if self._by_key.get((job.kind, job.key)) is job:
+                    del self._by_key[(job.kind, job.key)]
+
+    def _run(self, job, func):
+        _current.job = job
+        job.status = 'running'
+        try:
+            job.result = func()
+            job.status = 'done'
+        except Exception as e:
+            job.exception = e
+            job.status = 'failed'
+        finally:
+            _current.job = None
+            job.finish()
+
+    def clear(self):
+        """Forget every finished job, so the next identical request computes its result again."""
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.status in ('done', 'failed'):
+                    del self._jobs[job_id]
+                    if self._by_key.get((job.kind, job.key)) is job:
+                        del self._by_key[(job.kind, job.key)]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+def report_progress(done=None, total=None, partial=None):
+    """Report the progress of the job running in this thread, if any; partial results are merged by key."""
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job.report(done, total, partial)
+
+def write_output(chunk):
+    """Add a chunk to the output of the streaming job running in this thread, if any."""
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job.write(chunk)
+
+def screenshots_fingerprint(target=None):
+    """
+    Identify the state of one target, or of every target, and of the masks.
+
+    Adding or removing a build changes the target directory, and uploading
+    frames changes the build directory, so a finished job is reused until
+    a build it depends on changes.
+    """
+    targets = [target] if target is not None else list_subdirs(SCREENSHOTS_DIR)
+    digest = hashlib.blake2b(digest_size=16)
+    for path in [MASKS_FILE] + [os.path.join(SCREENSHOTS_DIR, t) for t in targets]:
+        try:
+            digest.update(file_identity(path).encode('utf-8'))
+        except OSError:
+            continue
+        if path != MASKS_FILE:
+            for build in list_subdirs(path):
+                digest.update(file_identity(os.path.join(path, build)).encode('utf-8'))
+    return digest.hexdigest()
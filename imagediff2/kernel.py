@@ -0,0 +1,142 @@
+from collections import namedtuple
+
+import numpy as np
+
+from imagediff2.config import DIFF_KERNEL, DIFF_CHANNEL_TOLERANCE, DIFF_PIXEL_TOLERANCE, DIFF_COARSE
+from imagediff2.decode import buffer_pool
+from imagediff2.framestore import StoredFrame
+from imagediff2.masks import mask_array, mask_for
+
+KERNELS = ('pil', 'numpy')
+
+# coarse enables the signature pass; it never changes a verdict, only how fast it is reached.
+# mask is the Mask of the compared movie, set by masked_options.
+DiffOptions = namedtuple('DiffOptions', ['kernel', 'channel_tolerance', 'pixel_tolerance', 'coarse', 'mask'],
+                         defaults=(False, None))
+
+def parse_channel_tolerance(value):
+    """Parse '2' or '2,2,4' into a per-channel (R, G, B) tolerance tuple."""
+    values = [int(v) for v in str(value).split(',') if v.strip()]
+    if len(values) == 1:
+        values = values * 3
+    if len(values) != 3:
+        raise ValueError(f"Channel tolerance needs 1 or 3 values, got {value!r}")
+    return tuple(values)
+
+def parse_flag(value):
+    return str(value).lower() not in ("", "0", "false", "no")
+
+def make_diff_options(kernel=None, channel_tolerance=None, pixel_tolerance=None, coarse=None):
+    """Build DiffOptions, falling back to the configured defaults."""
+    kernel = kernel or DIFF_KERNEL
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown diff kernel {kernel!r}")
+    return DiffOptions(
+        kernel,
+        parse_channel_tolerance(DIFF_CHANNEL_TOLERANCE if channel_tolerance is None else channel_tolerance),
+        int(DIFF_PIXEL_TOLERANCE if pixel_tolerance is None else pixel_tolerance),
+        DIFF_COARSE if coarse is None else parse_flag(coarse)
+    )
+
+def masked_options(options, target, movie):
+    """Return options with the mask of a movie of a target applied, if it has one."""
+    mask = mask_for(target, movie)
+    if mask is None:
+        return options
+    return (options or make_diff_options('pil', 0, 0))._replace(mask=mask)
+
+def is_exact(options):
+    return not any(options.channel_tolerance) and not options.pixel_tolerance and options.mask is None
+
+def options_variant(options):
+    """Cache variant of a set of options; every exact comparison shares 'exact'."""
+    if options is None or is_exact(options):
+        return 'exact'
+    variant = f"tol:{','.join(map(str, options.channel_tolerance))}:{options.pixel_tolerance}"
+    if options.mask is not None:
+        variant += f":mask:{options.mask.key}"
+    return variant
+
+def uses_numpy(options):
+    """Tolerances and masks are only implemented by the NumPy kernel."""
+    return options is not None and (options.kernel == 'numpy' or not is_exact(options))
+
+def as_rgb_array(image):
+    """RGB pixels of an image, or of a StoredFrame without copying them."""
+    if isinstance(image, StoredFrame):
+        return image.pixels
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image)
+
+def crop(image, box):
+    """Crop an image, or a StoredFrame to a view of its pixels."""
+    if isinstance(image, StoredFrame):
+        left, top, right, bottom = box
+        return StoredFrame(image.mode, (right - left, bottom - top), image.pixels[top:bottom, left:right])
+    return image.crop(box)
+
+def changed_bbox(changed, left=0, top=0):
+    """Bbox of the True pixels of a 2D array, offset by (left, top)."""
+    rows = np.flatnonzero(changed.any(axis=1))
+    cols = np.flatnonzero(changed.any(axis=0))
+    return (left + int(cols[0]), top + int(rows[0]), left + int(cols[-1]) + 1, top + int(rows[-1]) + 1)
+
+def exact_bbox(src_frame, cmp_frame):
+    """
+    Bbox of the pixels that differ between two StoredFrames, or None.
+
+    Stored frames share a mode from STORED_MODES, for which this is the
+    bbox the PIL kernel finds on the decoded images.
+    """
+    if src_frame.size != cmp_frame.size:
+        raise ValueError("images do not match")
+    with buffer_pool.array(src_frame.pixels.shape, np.bool_) as channel_changed, \
+            buffer_pool.array(src_frame.pixels.shape[:2], np.bool_) as changed:
+        np.not_equal(src_frame.pixels, cmp_frame.pixels, out=channel_changed)
+        np.any(channel_changed, axis=2, out=changed)
+        return changed_bbox(changed) if changed.any() else None
+
+def diff_stats(src_img, cmp_img, options):
+    """
+    Compare two images in one vectorized pass over their RGB pixels.
+
+    A pixel counts as changed when any channel moved by more than that
+    channel's tolerance, and the frames differ when more than
+    pixel_tolerance pixels changed. Pixels left out by options.mask are
+    never compared; the frames are cropped to the masked region first.
+    Either image may be a StoredFrame.
+
+    Returns a dict with 'has_diff', 'bbox' of the changed pixels and
+    'changed_pixels'.
+    """
+    if src_img.size != cmp_img.size:
+        raise ValueError("images do not match")
+
+    compared, (left, top) = None, (0, 0)
+    if options.mask is not None:
+        compared, box = mask_array(options.mask, src_img.size)
+        left, top = box[:2]
+        if box != (0, 0) + src_img.size:
+            src_img, cmp_img = crop(src_img, box), crop(cmp_img, box)
+
+    src = as_rgb_array(src_img)
+    cmp = as_rgb_array(cmp_img)
+
+    # Work arrays come from the buffer pool, so comparing a movie allocates them once
+    with buffer_pool.array(src.shape, np.int16) as delta, \
+            buffer_pool.array(src.shape, np.bool_) as channel_changed, \
+            buffer_pool.array(src.shape[:2], np.bool_) as changed:
+        np.subtract(src, cmp, out=delta, dtype=np.int16)
+        np.abs(delta, out=delta)
+        np.greater(delta, np.asarray(options.channel_tolerance, dtype=np.int16), out=channel_changed)
+        np.any(channel_changed, axis=2, out=changed)
+        if compared is not None:
+            changed &= compared
+        changed_pixels = int(np.count_nonzero(changed))
+
+        return {
+            'has_diff': changed_pixels > options.pixel_tolerance,
+            'bbox': changed_bbox(changed, left, top) if changed_pixels else None,
+            'changed_pixels': changed_pixels
+        }
@@ -1,13 +1,71 @@
+import fnmatch
+import json
 import os
-
-from PIL import Image
-from flask import Flask, render_template, jsonify, url_for, send_from_directory
-
-from config import SCREENSHOTS_DIR
-from imagediff import image_diff, encode_image, movie_diff
+import time
+from functools import partial
+
+from flask import (Flask, render_template, jsonify, url_for, send_from_directory, send_file, request, abort,
+                   Response, stream_with_context, g)
+from werkzeug.utils import safe_join
+
+from imagediff2.config import (SCREENSHOTS_DIR, IMAGE_CACHE_MAX_AGE, TARGET_BUILD_WINDOW,
+                               THUMBNAIL_SIZES, THUMBNAIL_PREVIEW_SIZE, SERVER_TIMING, PROFILING, PROFILE_INTERVAL)
+from imagediff2.cache import diff_cache
+from imagediff2.decode import decode_stats
+from imagediff2.framestore import frame_store
+from imagediff2.imagediff import frames_differ, diff_image_file, diff_image_mimetype, diff_tiles_file, movie_diff
+from imagediff2.manifest import get_manifest, list_subdirs, sorted_builds
+from imagediff2.reports import build_report, movie_history
+from imagediff2.engine import compare_frame_pairs
+from imagediff2.kernel import make_diff_options, masked_options
+from imagediff2.jobs import report_progress
+from imagediff2.metrics import (SamplingProfiler, collecting, record, render_prometheus, server_timing, timed,
+                                timed_stage)
+from imagediff2.serving import job_stream, job_view, job_status, jobs
+from imagediff2.timeline import MovieTimeline
+from imagediff2.thumbnails import thumbnail_file, thumbnail_mimetype
 
 app = Flask(__name__)
 
+# Default and maximum page sizes of /api/compare
+COMPARE_PAGE_SIZE = 100
+COMPARE_MAX_PAGE_SIZE = 1000
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.request_metrics = collecting()
+    g.request_samples = g.request_metrics.__enter__()
+    if PROFILING and request.args.get('profile'):
+        g.profiler = SamplingProfiler(PROFILE_INTERVAL).start()
+
+@app.after_request
+def finish_request_metrics(response):
+    """Count the request, add its Server-Timing header and swap in the profile if one was asked for."""
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    record('imagediff_http_requests_total', (('endpoint', endpoint), ('status', str(response.status_code))))
+    record('imagediff_http_request_seconds_total', (('endpoint', endpoint),), elapsed)
+
+    if SERVER_TIMING:
+        timing = server_timing(g.request_samples)
+        response.headers.add('Server-Timing', f"{timing}, total;dur={elapsed * 1000:.1f}" if timing
+                             else f"total;dur={elapsed * 1000:.1f}")
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        return Response(profiler.stop().report(), mimetype='text/plain')
+    return response
+
+@app.teardown_request
+def close_request_metrics(exc):
+    request_metrics = g.pop('request_metrics', None)
+    if request_metrics is not None:
+        request_metrics.__exit__(None, None, None)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
 def get_frame_number(filename):
     """Extract frame number from filename."""
     parts = filename.split('-')
@@ -20,100 +78,101 @@ def get_frame_number(filename):
 
 def get_sorted_builds(target_path, reverse=True):
     """Get sorted list of builds for a target."""
-    builds = [b for b in os.listdir(target_path)
-              if os.path.isdir(os.path.join(target_path, b))]
-    return sorted(builds, reverse=reverse)
+    return sorted_builds(target_path, reverse=reverse)
 
+@timed_stage('collect_movie_frames')
 def collect_movie_frames(target_path, builds):
     """Collect all movie frames information for all builds."""
     all_movies = set()
     build_movie_frames = {}
     build_files = {}
 
-    # Pre-collect file information to avoid multiple directory reads
-    for build in builds:
-        build_path = os.path.join(target_path, build)
-        build_files[build] = os.listdir(build_path)
-
-    # Process movie and frame data
+    # Read every build from its manifest instead of the filesystem
     for build in builds:
-        build_movie_frames[build] = {}
-
-        for file in build_files[build]:
-            if not os.path.isfile(os.path.join(target_path, build, file)):
-                continue
-
-            if "-" in file:
-                parts = file.split("-")
-                movie_name = parts[0]
-                frame_num = parts[1].split('.')[0]
-
-                if movie_name not in build_movie_frames[build]:
-                    build_movie_frames[build][movie_name] = []
-
-                build_movie_frames[build][movie_name].append(frame_num)
-                all_movies.add(movie_name)
+        manifest = get_manifest(os.path.join(target_path, build))
+        build_files[build] = manifest.all_files()
+        build_movie_frames[build] = {movie: manifest.frame_tokens(movie)
+                                     for movie in manifest.movie_names()}
+        all_movies.update(build_movie_frames[build])
 
     return all_movies, build_movie_frames, build_files
 
-def find_first_build_for_movies(all_movies, builds_ascending, build_movie_frames):
+def find_first_build_for_movies(all_movies, timeline):
     """Find the first build where each movie appears."""
-    first_build_for_movie = {}
-    for movie in all_movies:
-        for build in builds_ascending:
-            if movie in build_movie_frames.get(build, {}):
-                first_build_for_movie[movie] = build
-                break
-    return first_build_for_movie
-
-def calculate_reference_builds(all_movies, builds, build_movie_frames):
-    """Calculate reference builds for each movie in each build."""
-    movie_reference_builds = {}
-    for movie in all_movies:
-        movie_reference_builds[movie] = {}
-        for i, current_build in enumerate(builds):
-            has_in_current = movie in build_movie_frames.get(current_build, {})
+    return {movie: timeline.first_build(movie) for movie in all_movies}
+
+def find_reference_build(timeline, movie, current_build):
+    """
+    Find the build a movie in current_build is compared against.
+
+    Returns {'build': ..., 'frames': ...}. A build without the movie refers to
+    the next older build containing it. A build with the movie refers to
+    the next older build sharing frames with it, and those common frames.
+    """
+    if not timeline.has_movie(current_build, movie):
+        # Reference build needs to have the movie
+        return {
+            'build': timeline.next_build_with_movie(current_build, movie),
+            'frames': []  # Empty since current build doesn't have the movie
+        }
 
-            if not has_in_current:
-                reference_build = None
-                for j in range(i+1, len(builds)):
-                    if movie in build_movie_frames.get(builds[j], {}):
-                        reference_build = builds[j]
-                        break
-                movie_reference_builds[movie][current_build] = reference_build
-    return movie_reference_builds
+    reference_build, common_frames = timeline.next_build_with_common_frames(current_build, movie)
+    if reference_build is None:
+        return {
+            'build': None,
+            'frames': timeline.build_movie_frames[current_build][movie]
+        }
+    return {
+        'build': reference_build,
+        'frames': common_frames
+    }
 
 def get_movie_frames(build_path, movie_prefix=None):
     """Get all frames for a movie in a build path."""
-    all_files = [f for f in os.listdir(build_path)
-                 if os.path.isfile(os.path.join(build_path, f))]
-
-    if movie_prefix:
-        # Filter files for specific movie
-        movie_files = [f for f in all_files if f.startswith(f"{movie_prefix}-")]
-    else:
-        # Get all movie files
-        movie_files = [f for f in all_files if "-" in f]
-
-    return sorted(movie_files, key=get_frame_number)
-
-def extract_movie_names(files):
-    """Extract unique movie names from a list of files."""
-    movies = set()
-    for file in files:
-        if "-" in file:
-            movie_name = file.split("-")[0]
-            movies.add(movie_name)
-    return movies
+    return get_manifest(build_path).frame_files(movie_prefix or None)
 
 def create_frame_map(frames):
     """Create a map of frame numbers to filenames."""
     return {get_frame_number(f): f for f in frames}
 
+def diff_options_from_request():
+    """Read the diff kernel and tolerances from the query string (?kernel=&tolerance=&pixels=&coarse=)."""
+    try:
+        return make_diff_options(request.args.get('kernel'),
+                                 request.args.get('tolerance'),
+                                 request.args.get('pixels'),
+                                 request.args.get('coarse'))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+def optional_int_arg(name):
+    """Read a non-negative integer query argument, None if it is absent."""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    value = int(value)
+    if value < 0:
+        raise ValueError(f"{name} must not be negative")
+    return value
+
+def select_build_window(builds, since=None, until=None, count=None):
+    """
+    Select the positions of the builds to show in the target matrix.
+
+    builds is ordered newest first. since and until bound the window by build
+    name, both inclusive. count keeps only the newest builds of the window.
+    """
+    window = [i for i, build in enumerate(builds)
+              if (until is None or build <= until) and (since is None or build >= since)]
+    return window if count is None else window[:count]
+
+def diff_query_args():
+    """Diff option query arguments to carry over into generated links."""
+    return {k: v for k, v in request.args.items() if k in ('kernel', 'tolerance', 'pixels', 'coarse')}
+
 @app.route('/')
 def index():
-    targets = [d for d in os.listdir(SCREENSHOTS_DIR)
-               if os.path.isdir(os.path.join(SCREENSHOTS_DIR, d))]
+    targets = list_subdirs(SCREENSHOTS_DIR)
 
     return render_template('index.html', targets=targets)
 
@@ -130,80 +189,55 @@ def target_detail(target):
     # Only return the page framework with build list but without table data
     return render_template('target.html',
                            target=target,
-                           builds=builds)
+                           builds=builds,
+                           build_window=TARGET_BUILD_WINDOW)
 
-# Handle time-consuming data calculations
-@app.route('/api/target_data/<target>')
-def target_data_api(target):
+def plan_target_matrix(target):
+    """
+    Read a target matrix request and plan it.
+
+    Returns (data, builds, rows): data holds every field of the matrix but
+    the bars, builds lists every build of the target and rows lazily yields
+    (movie, bars) for the requested movies, computing one movie at a time.
+    Returns (error response, None, None) for a bad request.
+    """
     target_path = os.path.join(SCREENSHOTS_DIR, target)
 
     if not os.path.exists(target_path) or not os.path.isdir(target_path):
-        return jsonify({"error": "Target not found"}), 404
+        return (jsonify({"error": "Target not found"}), 404), None, None
 
+    options = diff_options_from_request()
     builds = get_sorted_builds(target_path)
-    builds_ascending = get_sorted_builds(target_path, reverse=False)
+
+    try:
+        window = select_build_window(builds, request.args.get('since'), request.args.get('until'),
+                                     optional_int_arg('builds'))
+        movie_offset = optional_int_arg('offset') or 0
+        movie_limit = optional_int_arg('limit')
+    except ValueError:
+        return (jsonify({"error": "builds, offset and limit must be non-negative integers"}), 400), None, None
 
     # Collect movie frame data
     all_movies, build_movie_frames, _ = collect_movie_frames(target_path, builds)
 
-    # Calculate first build for each movie
-    first_build_for_movie = find_first_build_for_movies(
-        all_movies, builds_ascending, build_movie_frames)
-
-    # Calculate reference builds
-    movie_reference_builds = {}
-    for movie in all_movies:
-        movie_reference_builds[movie] = {}
-        for i, current_build in enumerate(builds):
-            has_in_current = movie in build_movie_frames.get(current_build, {})
-            current_frames = build_movie_frames.get(current_build, {}).get(movie, [])
+    # Index movie and frame presence over the build order
+    timeline = MovieTimeline(builds, build_movie_frames)
 
-            if not has_in_current:
-                # Reference build needs to have the movie
-                reference_build = None
-                for j in range(i+1, len(builds)):
-                    next_build = builds[j]
-                    if movie in build_movie_frames.get(next_build, {}):
-                        reference_build = next_build
-                        break
-                movie_reference_builds[movie][current_build] = {
-                    'build': reference_build,
-                    'frames': []  # Empty since current build doesn't have the movie
-                }
-            else:
-                # Current build has the movie, find a reference build with matching frames
-                reference_data = {
-                    'build': None,
-                    'frames': current_frames
-                }
-
-                for j in range(i+1, len(builds)):
-                    next_build = builds[j]
-                    if movie in build_movie_frames.get(next_build, {}):
-                        next_frames = build_movie_frames.get(next_build, {}).get(movie, [])
-
-                        # Check if current frames exist in the next build
-                        common_frames = set(current_frames).intersection(set(next_frames))
-                        if common_frames:
-                            reference_data = {
-                                'build': next_build,
-                                'frames': list(common_frames)
-                            }
-                            break
-
-                movie_reference_builds[movie][current_build] = reference_data
+    # Calculate first build for each movie
+    first_build_for_movie = find_first_build_for_movies(all_movies, timeline)
 
     # Pre-calculate image difference results
     image_diff_cache = {}
     def get_image_diff(current_build, prev_build, movie, frame):
         cache_key = (current_build, prev_build, movie, frame)
         if cache_key not in image_diff_cache:
-            current_frame_path = os.path.join(target_path, current_build, f"{movie}-{frame}.png")
-            prev_frame_path = os.path.join(target_path, prev_build, f"{movie}-{frame}.png")
+            current_frame_path = get_manifest(os.path.join(target_path, current_build)).frame_path(movie, frame)
+            prev_frame_path = get_manifest(os.path.join(target_path, prev_build)).frame_path(movie, frame)
 
-            if os.path.exists(current_frame_path) and os.path.exists(prev_frame_path):
+            if current_frame_path and prev_frame_path:
                 try:
-                    image_diff_cache[cache_key] = image_diff(current_frame_path, prev_frame_path)
+                    image_diff_cache[cache_key] = frames_differ(current_frame_path, prev_frame_path,
+                                                                masked_options(options, target, movie))
                 except Exception as e:
                     print(f"Error comparing frames {movie}-{frame}: {e}")
                     image_diff_cache[cache_key] = {'has_diff': True}
@@ -231,17 +265,23 @@ def target_data_api(target):
     def get_movie_diff_cached(current_build, prev_build, target, movie):
         cache_key = (current_build, prev_build, target, movie)
         if cache_key not in movie_diff_cache:
-            movie_diff_cache[cache_key] = movie_diff(current_build, prev_build, target, movie)
+            movie_diff_cache[cache_key] = movie_diff(current_build, prev_build, target, movie, options)
         return movie_diff_cache[cache_key]
 
+    # Only the requested page of movies is computed
     movies = sorted(list(all_movies))
-    continuous_bars = {}
-
-    # Create continuous bars for visualization with updated skip logic
-    for movie in movies:
-        continuous_bars[movie] = []
-
-        for i, current_build in enumerate(builds):
+    movie_pattern = request.args.get('movie')
+    if movie_pattern:
+        movies = [movie for movie in movies if fnmatch.fnmatchcase(movie, movie_pattern)]
+    total_movies = len(movies)
+    movies = movies[movie_offset:None if movie_limit is None else movie_offset + movie_limit]
+
+    # Create continuous bars for visualization with updated skip logic, for the requested builds only
+    def movie_bars(movie):
+        bars = []
+
+        for i in window:
+            current_build = builds[i]
             prev_build = builds[i+1] if i < len(builds)-1 else None
 
             has_in_current = movie in build_movie_frames.get(current_build, {})
@@ -256,17 +296,17 @@ def target_data_api(target):
 
             # Build entry information
             if is_first_build:
-                continuous_bars[movie].append({
+                bars.append({
                     'build': current_build,
                     'type': 'first'
                 })
             elif not has_in_current and prev_build:
                 # Modified skip build logic
-                reference_data = movie_reference_builds[movie].get(current_build, {'build': None, 'frames': []})
+                reference_data = find_reference_build(timeline, movie, current_build)
                 reference_build = reference_data['build']
 
                 if reference_build:
-                    continuous_bars[movie].append({
+                    bars.append({
                         'build': current_build,
                         'reference_build': reference_build,
                         'type': 'diff',
@@ -275,7 +315,7 @@ def target_data_api(target):
                         'compare_with': reference_build
                     })
                 else:
-                    continuous_bars[movie].append({
+                    bars.append({
                         'build': current_build,
                         'type': 'missing'
                     })
@@ -292,7 +332,7 @@ def target_data_api(target):
                                 has_any_diff = True
                                 break
 
-                        continuous_bars[movie].append({
+                        bars.append({
                             'build': current_build,
                             'has_diff': has_any_diff,
                             'compare_with': prev_build,
@@ -302,7 +342,7 @@ def target_data_api(target):
                     else:
                         has_diff = get_movie_diff_cached(current_build, prev_build, target, movie)
 
-                        continuous_bars[movie].append({
+                        bars.append({
                             'build': current_build,
                             'has_diff': has_diff,
                             'compare_with': prev_build,
@@ -310,7 +350,7 @@ def target_data_api(target):
                         })
                 else:
                     # Modified readded build logic
-                    reference_data = movie_reference_builds[movie].get(current_build, {'build': None, 'frames': []})
+                    reference_data = find_reference_build(timeline, movie, current_build)
                     reference_build = reference_data['build']
                     comparable_frames = reference_data['frames']
 
@@ -318,7 +358,7 @@ def target_data_api(target):
                     if reference_build and comparable_frames:
                         has_diff = get_movie_diff_for_frames(current_build, reference_build, target, movie, comparable_frames)
 
-                    continuous_bars[movie].append({
+                    bars.append({
                         'build': current_build,
                         'type': 'readded',
                         'compare_with': reference_build,
@@ -327,73 +367,134 @@ def target_data_api(target):
                         'no_reference': reference_build is None
                     })
             elif not prev_build:
-                continuous_bars[movie].append({
+                bars.append({
                     'build': current_build,
                     'type': 'unknown'
                 })
 
+        return bars
+
     # Generate URL templates needed by frontend
     urls = {
-        'movie_url': url_for('movie', movie='MOVIE_PLACEHOLDER'),
+        'movie_url': url_for('movie', movie='MOVIE_PLACEHOLDER', **diff_query_args()),
+        'build_url': url_for('build', build='BUILD_PLACEHOLDER', **diff_query_args()),
         'compare_url': url_for('compare',
                                build1='BUILD1_PLACEHOLDER',
                                build2='BUILD2_PLACEHOLDER',
                                target='TARGET_PLACEHOLDER',
-                               movie='MOVIE_PLACEHOLDER'),
+                               movie='MOVIE_PLACEHOLDER',
+                               **diff_query_args()),
         'single_build_url': url_for('view_single_build',
                                     build='BUILD_PLACEHOLDER',
                                     target='TARGET_PLACEHOLDER',
                                     movie='MOVIE_PLACEHOLDER')
     }
 
-    # Return all data to frontend
     data = {
         'target': target,
-        'builds': builds,
+        'builds': [builds[i] for i in window],
+        'next_build': builds[window[-1] + 1] if window and window[-1] < len(builds) - 1 else None,
         'movies': movies,
-        'continuous_bars': continuous_bars,
+        'total_movies': total_movies,
+        'offset': movie_offset,
         'urls': urls
     }
 
-    return jsonify(data)
+    return data, builds, ((movie, movie_bars(movie)) for movie in movies)
 
-@app.route('/movie/<movie>')
-def movie(movie):
-    target_builds = {}
-    all_builds = set()
-    diff_matrix = {}
+# Handle time-consuming data calculations
+@app.route('/api/target_data/<target>')
+@job_view('target_data', target_arg='target')
+def target_data_api(target):
+    data, _, rows = plan_target_matrix(target)
+    if rows is None:
+        return data
+
+    continuous_bars = {}
+    report_progress(0, len(data['movies']))
+    for done, (movie, bars) in enumerate(rows, 1):
+        continuous_bars[movie] = bars
+        report_progress(done, partial={movie: bars})
+
+    # Return all data to frontend
+    data['continuous_bars'] = continuous_bars
+    with timed('json'):
+        return jsonify(data)
 
-    # Scan through all targets
-    for target in os.listdir(SCREENSHOTS_DIR):
-        target_path = os.path.join(SCREENSHOTS_DIR, target)
-        if os.path.isdir(target_path):
-            # Get sorted builds
-            builds = get_sorted_builds(target_path)
+# Kinds of cells in the columnar rows of target_rows_api
+CELL_KINDS = ('first', 'diff', 'partial', 'skipped', 'missing', 'readded', 'unknown')
 
-            # Find builds containing this movie
-            builds_with_movie = []
-            for build in builds:
-                build_path = os.path.join(target_path, build)
-                movie_files = get_movie_frames(build_path, movie)
+def encode_bars(bars, build_index):
+    """
+    Encode the bars of a movie column by column: the kind of every cell as
+    an index into CELL_KINDS, has_diff as 0/1 and the compared build as an
+    index into the build list of the header, None where a cell has none.
+    The frames of re-added cells are keyed by cell position.
+    """
+    kinds, has_diff, compare_with, common_frames = [], [], [], {}
+    for position, bar in enumerate(bars):
+        kind = bar['type']
+        if bar.get('is_partial'):
+            kind = 'partial'
+        elif bar.get('is_skipped'):
+            kind = 'skipped'
+        kinds.append(CELL_KINDS.index(kind))
+        has_diff.append(int(bar['has_diff']) if 'has_diff' in bar else None)
+        compare_with.append(build_index[bar['compare_with']] if bar.get('compare_with') else None)
+        if bar.get('common_frames'):
+            common_frames[position] = bar['common_frames']
+    return {'kind': kinds, 'has_diff': has_diff, 'compare_with': compare_with, 'common_frames': common_frames}
+
+@app.route('/api/target_rows/<target>')
+@job_stream('target_rows', target_arg='target')
+def target_rows_api(target):
+    """
+    Stream the target matrix of target_data_api as NDJSON.
+
+    The first line is the header: the fields of target_data_api but the
+    bars, plus every build of the target ('build_names') and CELL_KINDS.
+    Each following line holds the bars of one movie, encoded by
+    encode_bars, sent as soon as the movie is computed. Rows are computed
+    by a background job in movie order, so identical loads share it and
+    a reload replays the rows already computed.
+    """
+    data, builds, rows = plan_target_matrix(target)
+    if rows is None:
+        return data
 
-                if movie_files:
-                    builds_with_movie.append(build)
-                    all_builds.add(build)
+    build_index = {build: i for i, build in enumerate(builds)}
 
-            # Calculate diffs between consecutive builds
-            for i in range(len(builds_with_movie) - 1):
-                current_build = builds_with_movie[i]
-                prev_build = builds_with_movie[i + 1]
+    def generate():
+        yield json.dumps({**data, 'build_names': builds, 'kinds': CELL_KINDS}) + "\n"
+        report_progress(0, len(data['movies']))
+        for done, (movie, bars) in enumerate(rows, 1):
+            yield json.dumps({'movie': movie, **encode_bars(bars, build_index)}) + "\n"
+            report_progress(done)
 
-                has_diff = movie_diff(current_build, prev_build, target, movie)
+    return generate()
+
+@app.route('/movie/<movie>')
+@job_view('movie')
+def movie(movie):
+    options = diff_options_from_request()
+    target_builds = {}
+    all_builds = set()
+    diff_matrix = {}
 
-                if target not in diff_matrix:
-                    diff_matrix[target] = {}
+    # Histories are precomputed and only extended with the builds added since
+    targets = list_subdirs(SCREENSHOTS_DIR)
+    report_progress(0, len(targets))
+    for done, target in enumerate(targets, 1):
+        history = movie_history(target, movie, options)
 
-                diff_matrix[target][(current_build, prev_build)] = has_diff
+        if history['with_movie']:
+            target_builds[target] = history['with_movie']
+            all_builds.update(history['with_movie'])
+        if history['verdicts']:
+            diff_matrix[target] = {(current, prev): has_diff for current, prev, has_diff in history['verdicts']}
 
-            if builds_with_movie:
-                target_builds[target] = builds_with_movie
+        report_progress(done, partial={target: [{'build': current, 'compare_with': prev, 'has_diff': has_diff}
+                                                for current, prev, has_diff in history['verdicts']]})
 
     all_builds = sorted(list(all_builds), reverse=True)
 
@@ -404,50 +505,21 @@ def movie(movie):
                            diff_matrix=diff_matrix)
 
 @app.route('/build/<build>')
+@job_view('build')
 def build(build):
-    target_info = {}
-
-    for target in os.listdir(SCREENSHOTS_DIR):
-        target_path = os.path.join(SCREENSHOTS_DIR, target)
-        if not os.path.isdir(target_path):
-            continue
-
-        # Get sorted builds
-        builds = get_sorted_builds(target_path)
-
-        # Check if current build exists in this target
-        if build not in builds:
-            continue
-
-        # Find the previous build
-        build_index = builds.index(build)
-        prev_build = builds[build_index + 1] if build_index < len(builds) - 1 else None
-
-        # Find all movies in this build
-        build_path = os.path.join(target_path, build)
-        movie_files = get_movie_frames(build_path)
-        movies = extract_movie_names(movie_files)
-
-        # Calculate differences for each movie
-        movie_diffs = {}
-        if prev_build:
-            for movie in movies:
-                has_diff = movie_diff(build, prev_build, target, movie)
-                movie_diffs[movie] = has_diff
-
-        # Store target information
-        target_info[target] = {
-            'prev_build': prev_build,
-            'movies': sorted(list(movies)),
-            'movie_diffs': movie_diffs
-        }
+    target_info = build_report(build, diff_options_from_request())
 
     return render_template('build.html',
                            build=build,
                            target_info=target_info)
 
-@app.route('/compare/<build1>/<build2>/<target>/<movie>')
-def compare(build1, build2, target, movie):
+def list_frame_comparisons(build1, build2, target, movie):
+    """
+    List the common frames of a movie in two builds as pending comparisons.
+
+    Returns the comparison entries sorted by frame number and the matching
+    (build1 path, build2 path) pairs.
+    """
     build1_path = os.path.join(SCREENSHOTS_DIR, target, build1)
     build2_path = os.path.join(SCREENSHOTS_DIR, target, build2)
 
@@ -462,48 +534,111 @@ def compare(build1, build2, target, movie):
     # Find only common frames between the two builds
     common_frame_numbers = sorted(set(build1_frame_map.keys()).intersection(set(build2_frame_map.keys())))
 
-    # For each common frame number, create a comparison entry
-    frame_comparisons = []
+    comparisons = []
+    pairs = []
 
     # Process only common frames
     for frame_num in common_frame_numbers:
         build1_frame = build1_frame_map.get(frame_num)
         build2_frame = build2_frame_map.get(frame_num)
 
-        comparison = {
+        comparisons.append({
             'frame_number': frame_num,
             'build1_frame': build1_frame,
             'build2_frame': build2_frame,
-            'has_diff': False,
-            'diff_data': None
-        }
-
-        # Calculate diff
-        img1_path = os.path.join(build1_path, build1_frame)
-        img2_path = os.path.join(build2_path, build2_frame)
+            'has_diff': None,
+            'build1_url': url_for('screenshots', filename=f"{target}/{build1}/{build1_frame}"),
+            'build2_url': url_for('screenshots', filename=f"{target}/{build2}/{build2_frame}"),
+            'build1_thumb_url': url_for('thumbnail', size=THUMBNAIL_PREVIEW_SIZE, filename=f"{target}/{build1}/{build1_frame}"),
+            'build2_thumb_url': url_for('thumbnail', size=THUMBNAIL_PREVIEW_SIZE, filename=f"{target}/{build2}/{build2_frame}"),
+            'diff_url': None,
+            'diff_tiles_url': None
+        })
+        pairs.append((os.path.join(build1_path, build1_frame), os.path.join(build2_path, build2_frame)))
+
+    return comparisons, pairs
+
+def iter_frame_verdicts(comparisons, pairs, build1, build2, target, options):
+    """
+    Compute verdicts for the given comparisons on the worker pool.
 
-        try:
-            diff_result = image_diff(img1_path, img2_path)
-            comparison['has_diff'] = diff_result.get('has_diff', False)
-            comparison['diff_data'] = diff_result
-        except Exception as e:
-            print(f"Error comparing images: {e}")
+    Yields each comparison, filled in, as soon as its verdict is known.
+    Diff images and tiles themselves are rendered by diff_image and
+    diff_tiles on request.
+    """
+    comparisons_by_path = dict(zip(pairs, comparisons))
+
+    for pair, diff_result in compare_frame_pairs(pairs, partial(frames_differ, options=options)):
+        comparison = comparisons_by_path[pair]
+        comparison['has_diff'] = diff_result is not None and diff_result.get('has_diff', False)
+        if comparison['has_diff']:
+            comparison['diff_url'] = diff_image_url(target, build1, comparison['build1_frame'],
+                                                    build2, comparison['build2_frame'])
+            comparison['diff_tiles_url'] = diff_image_url(target, build1, comparison['build1_frame'],
+                                                          build2, comparison['build2_frame'],
+                                                          endpoint='diff_tiles')
+        yield comparison
 
-        frame_comparisons.append(comparison)
+@app.route('/compare/<build1>/<build2>/<target>/<movie>')
+def compare(build1, build2, target, movie):
+    """
+    Render the comparison table right away; verdicts and diff images are
+    filled in by the page from the streaming compare API.
+    """
+    diff_options_from_request()
+    comparisons, _ = list_frame_comparisons(build1, build2, target, movie)
 
-    # Calculate summary statistics
+    # Summary statistics, different_frames is counted by the page as verdicts arrive
     stats = {
-        'total_common_frames': len(common_frame_numbers),
-        'different_frames': sum(1 for comp in frame_comparisons if comp.get('has_diff', False))
+        'total_common_frames': len(comparisons),
+        'different_frames': None
     }
 
+    api_url = url_for('compare_api', build1=build1, build2=build2, target=target, movie=movie,
+                      stream=1, **diff_query_args())
+
     return render_template('compare.html',
                            build1=build1,
                            build2=build2,
                            target=target,
                            movie=movie,
-                           comparisons=frame_comparisons,
-                           stats=stats)
+                           comparisons=comparisons,
+                           stats=stats,
+                           api_url=api_url)
+
+@app.route('/api/compare/<build1>/<build2>/<target>/<movie>')
+def compare_api(build1, build2, target, movie):
+    """
+    Frame verdicts of a movie between two builds.
+
+    Returns one page of comparisons (?offset=&limit=) in frame order, or with
+    ?stream=1 every comparison as a line of NDJSON as soon as it is computed.
+    """
+    options = masked_options(diff_options_from_request(), target, movie)
+    comparisons, pairs = list_frame_comparisons(build1, build2, target, movie)
+
+    if request.args.get('stream'):
+        def generate():
+            for comparison in iter_frame_verdicts(comparisons, pairs, build1, build2, target, options):
+                yield json.dumps(comparison) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', COMPARE_PAGE_SIZE)), 1), COMPARE_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+
+    page = slice(offset, offset + limit)
+    list(iter_frame_verdicts(comparisons[page], pairs[page], build1, build2, target, options))
+
+    return jsonify({
+        'total': len(comparisons),
+        'offset': offset,
+        'limit': limit,
+        'comparisons': comparisons[page]
+    })
 
 @app.route('/view/<target>/<build>/<movie>')
 def view_single_build(target, build, movie):
@@ -513,23 +648,15 @@ def view_single_build(target, build, movie):
     build_path = os.path.join(SCREENSHOTS_DIR, target, build)
     frames = get_movie_frames(build_path, movie)
 
-    # Prepare frame data for the template
+    # Prepare frame data for the template, images are loaded by the browser
     frame_data = []
     for frame in frames:
-        frame_path = os.path.join(build_path, frame)
-        frame_num = get_frame_number(frame)
-
-        try:
-            img = Image.open(frame_path)
-            img_data = encode_image(img)
-
-            frame_data.append({
-                'frame_number': frame_num,
-                'filename': frame,
-                'img_data': img_data
-            })
-        except Exception as e:
-            print(f"Error processing frame {frame}: {e}")
+        frame_data.append({
+            'frame_number': get_frame_number(frame),
+            'filename': frame,
+            'img_url': url_for('screenshots', filename=f"{target}/{build}/{frame}"),
+            'thumb_url': url_for('thumbnail', size=THUMBNAIL_PREVIEW_SIZE, filename=f"{target}/{build}/{frame}")
+        })
 
     return render_template('view.html',
                            target=target,
@@ -537,9 +664,135 @@ def view_single_build(target, build, movie):
                            movie=movie,
                            frames=frame_data)
 
+@app.route('/metrics')
+def metrics():
+    """Counters and gauges of this process in the Prometheus text format."""
+    decode = decode_stats()
+    job_counts = {}
+    for job in jobs.list():
+        job_counts[job.status] = job_counts.get(job.status, 0) + 1
+
+    gauges = [
+        ('imagediff_decode_bytes_in_flight', "Decoded pixel bytes currently held.", [((), decode['in_flight'])]),
+        ('imagediff_decode_bytes_peak', "Most decoded pixel bytes held at once.", [((), decode['peak'])]),
+        ('imagediff_decode_budget_bytes', "Decoded pixel bytes allowed at once, 0 if unlimited.",
+         [((), decode['budget'])]),
+        ('imagediff_decode_waits', "Decodes that waited for memory.", [((), decode['waits'])]),
+        ('imagediff_buffer_pool_bytes', "Bytes of work arrays kept for reuse.", [((), decode['pool']['pooled'])]),
+        ('imagediff_frame_store_bytes', "Bytes of decoded frames in the frame store.",
+         [((), frame_store.stats()['stored'])]),
+        ('imagediff_jobs', "Background jobs known by status.",
+         [((('status', status),), count) for status, count in sorted(job_counts.items())]),
+        ('imagediff_jobs_reused', "Requests answered by an existing job.", [((), jobs.reused)]),
+        ('imagediff_cache_enabled', "Whether the persistent diff cache is in use.", [((), int(diff_cache.enabled))]),
+    ]
+    return Response(render_prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/jobs')
+def jobs_api():
+    """Every known background job, most recently used last."""
+    return jsonify({'jobs': [job_status(job) for job in jobs.list()]})
+
+@app.route('/api/jobs/<job_id>')
+def job_status_api(job_id):
+    """
+    Progress of a background job and its number of partial results.
+
+    ?since=N adds the partial results reported after the first N, so a
+    client polling the job only receives the new ones.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job, request.args.get('since', type=int)))
+
+def frame_pair_paths(target, build1, build2, filename):
+    """
+    Paths of a frame in two builds, or None if either does not exist.
+
+    The frame is looked up under the same filename in both builds unless
+    ?cmp= names the build2 file.
+    """
+    src_img_path = safe_join(SCREENSHOTS_DIR, target, build1, filename)
+    cmp_img_path = safe_join(SCREENSHOTS_DIR, target, build2, request.args.get('cmp', filename))
+
+    if not src_img_path or not cmp_img_path or not os.path.isfile(src_img_path) or not os.path.isfile(cmp_img_path):
+        return None
+    return src_img_path, cmp_img_path
+
+@app.route('/diff/<target>/<build1>/<build2>/<filename>')
+def diff_image(target, build1, build2, filename):
+    """
+    Serve the difference image of a frame between two builds.
+
+    Frames are looked up by frame_pair_paths. ?size= serves a thumbnail instead.
+    """
+    paths = frame_pair_paths(target, build1, build2, filename)
+    if paths is None:
+        return "Frame not found", 404
+    src_img_path, cmp_img_path = paths
+
+    try:
+        diff_path = diff_image_file(src_img_path, cmp_img_path)
+    except (IOError, ValueError) as e:
+        print(f"Error rendering diff of {filename}: {e}")
+        return "Cannot compare frames", 422
+
+    size = request.args.get('size', type=int)
+    if size is not None:
+        return send_thumbnail(diff_path, size)
+
+    return send_file(diff_path, mimetype=diff_image_mimetype(), conditional=True, max_age=IMAGE_CACHE_MAX_AGE)
+
+@app.route('/api/tiles/<target>/<build1>/<build2>/<filename>')
+def diff_tiles(target, build1, build2, filename):
+    """
+    Sparse difference of a frame between two builds: bbox, stats and the
+    changed tiles packed in a base64 PNG atlas, looked up like diff_image.
+    """
+    paths = frame_pair_paths(target, build1, build2, filename)
+    if paths is None:
+        return jsonify({"error": "Frame not found"}), 404
+
+    try:
+        tiles_path = diff_tiles_file(*paths)
+    except (IOError, ValueError) as e:
+        print(f"Error rendering diff tiles of {filename}: {e}")
+        return jsonify({"error": "Cannot compare frames"}), 422
+
+    return send_file(tiles_path, mimetype='application/json', conditional=True, max_age=IMAGE_CACHE_MAX_AGE)
+
+def diff_image_url(target, build1, build1_frame, build2, build2_frame, endpoint='diff_image'):
+    """
+    URL of the diff_image route for a pair of frames. endpoint selects
+    another route taking the same arguments, like diff_tiles.
+    """
+    extra = {'cmp': build2_frame} if build2_frame != build1_frame else {}
+    return url_for(endpoint, target=target, build1=build1, build2=build2, filename=build1_frame, **extra)
+
 @app.route('/screenshots/<path:filename>')
 def screenshots(filename):
-    return send_from_directory(SCREENSHOTS_DIR, filename)
+    return send_from_directory(SCREENSHOTS_DIR, filename, max_age=IMAGE_CACHE_MAX_AGE)
+
+@app.route('/thumbs/<int:size>/<path:filename>')
+def thumbnail(size, filename):
+    """Serve a downscaled preview of a screenshot."""
+    image_path = safe_join(SCREENSHOTS_DIR, filename)
+    if not image_path or not os.path.isfile(image_path):
+        return "Frame not found", 404
+    return send_thumbnail(image_path, size)
+
+def send_thumbnail(image_path, size):
+    if size not in THUMBNAIL_SIZES:
+        return "Unsupported thumbnail size", 404
+
+    try:
+        path = thumbnail_file(image_path, size)
+    except IOError as e:
+        print(f"Error rendering thumbnail of {image_path}: {e}")
+        return "Cannot render thumbnail", 422
+
+    return send_file(path, mimetype=thumbnail_mimetype(), conditional=True, max_age=IMAGE_CACHE_MAX_AGE)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    app.run(debug=True, port=5001, threaded=True)
\ No newline at end of file
@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+from collections import namedtuple
+
+from imagediff2.cache import diff_cache, file_identity
+from imagediff2.metrics import timed_stage
+
+FrameEntry = namedtuple('FrameEntry', ['filename', 'size', 'mtime_ns'])
+
+def frame_number(frame):
+    """Convert a frame token such as '007' into an int, 0 if it is not numeric."""
+    try:
+        return int(frame)
+    except ValueError:
+        return 0
+
+def parse_frame_filename(filename):
+    """Split '<movie>-<frame>.<ext>' into (movie, frame), or None if it is not a frame."""
+    if "-" not in filename:
+        return None
+    parts = filename.split("-")
+    return parts[0], parts[1].split('.')[0]
+
+class BuildManifest:
+    """
+    Index of the frames of a single build directory.
+
+    Maps movie -> frame -> FrameEntry(filename, size, mtime_ns). Content
+    digests are left to file_fingerprint, so listing a build never reads
+    its frames.
+    """
+
+    def __init__(self, path, movies):
+        self.path = path
+        self.movies = movies
+
+    def movie_names(self):
+        return set(self.movies)
+
+    def has_movie(self, movie):
+        return movie in self.movies
+
+    def frames(self, movie):
+        """Return the {frame: FrameEntry} map of a movie, empty if the build lacks it."""
+        return self.movies.get(movie, {})
+
+    def frame_tokens(self, movie):
+        """Return the frame tokens of a movie in filename order."""
+        return list(self.frames(movie))
+
+    def frame_files(self, movie=None):
+        """Return frame filenames of one movie, or of every movie, sorted by frame number."""
+        if movie is not None:
+            entries = self.frames(movie).values()
+        else:
+            entries = [entry for frames in self.movies.values() for entry in frames.values()]
+        return [e.filename for e in sorted(entries, key=lambda e: frame_number(parse_frame_filename(e.filename)[1]))]
+
+    def all_files(self):
+        return [entry.filename for frames in self.movies.values() for entry in frames.values()]
+
+    def frame_path(self, movie, frame):
+        """Absolute path of a frame, or None if the build does not contain it."""
+        entry = self.frames(movie).get(frame)
+        return os.path.join(self.path, entry.filename) if entry else None
+
+    def to_json(self):
+        return json.dumps({movie: {frame: list(entry) for frame, entry in frames.items()}
+                           for movie, frames in self.movies.items()})
+
+    @classmethod
+    def from_json(cls, path, data):
+        # Manifests cached by older versions also carry a digest, which is ignored
+        movies = {movie: {frame: FrameEntry(*entry[:3]) for frame, entry in frames.items()}
+                  for movie, frames in json.loads(data).items()}
+        return cls(path, movies)
+
+@timed_stage('scan_build')
+def scan_build(build_path):
+    """Scan a build directory once with os.scandir, keeping the stat data of every frame."""
+    movies = {}
+    with os.scandir(build_path) as it:
+        entries = sorted((e for e in it if e.is_file()), key=lambda e: e.name)
+
+    for entry in entries:
+        parsed = parse_frame_filename(entry.name)
+        if parsed is None:
+            continue
+        movie, frame = parsed
+        st = entry.stat()
+        movies.setdefault(movie, {})[frame] = FrameEntry(entry.name, st.st_size, st.st_mtime_ns)
+
+    return BuildManifest(build_path, movies)
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def get_manifest(build_path):
+    """
+    Return the manifest of a build, scanning the directory only when needed.
+
+    Manifests are memoized in-process and persisted in the diff cache, keyed
+    on the directory identity, so a build is rescanned only after its
+    directory mtime changes.
+    """
+    key = file_identity(build_path)
+    with _manifests_lock:
+        cached = _manifests.get(build_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    data = diff_cache.get_manifest(key)
+    if data is not None:
+        manifest = BuildManifest.from_json(build_path, data)
+    else:
+        manifest = scan_build(build_path)
+        diff_cache.put_manifest(key, manifest.to_json())
+
+    with _manifests_lock:
+        _manifests[build_path] = (key, manifest)
+    return manifest
+
+def list_subdirs(path):
+    """Return the sorted names of the subdirectories of path, skipping hidden ones."""
+    with os.scandir(path) as it:
+        return sorted(e.name for e in it if e.is_dir() and not e.name.startswith('.'))
+
+def sorted_builds(target_path, reverse=True):
+    """Return the builds of a target, newest first unless reverse is False."""
+    return sorted(list_subdirs(target_path), reverse=reverse)
@@ -0,0 +1,130 @@
+import fnmatch
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from PIL import Image
+
+from imagediff2.config import MASKS_FILE
+from imagediff2.cache import file_identity
+from imagediff2.fingerprint import file_fingerprint
+
+# Compared arrays kept per process, one per mask and frame size
+MASK_ARRAYS_KEPT = 64
+
+# regions are the rectangles to compare (the whole frame if empty), ignore the
+# rectangles left out, images mask PNGs whose black pixels are left out. key
+# identifies the mask in verdict cache keys and changes with any mask PNG.
+Mask = namedtuple('Mask', ['regions', 'ignore', 'images', 'key'])
+
+_rules = (None, [])
+_rules_lock = threading.Lock()
+
+def load_mask_rules():
+    """
+    Read the mask rules, rereading the file only after it changed.
+
+    MASKS_FILE holds a JSON list of rules such as
+    {"target": "tA", "movie": "hud*", "ignore": [[0, 0, 200, 40]], "image": "masks/hud.png"}.
+    target and movie are glob patterns, "*" when left out. Rectangles are
+    [left, top, right, bottom] and image paths are relative to the file.
+    """
+    global _rules
+    try:
+        identity = file_identity(MASKS_FILE)
+    except OSError:
+        return []
+
+    with _rules_lock:
+        if _rules[0] == identity:
+            return _rules[1]
+
+    try:
+        with open(MASKS_FILE) as f:
+            rules = json.load(f)
+        if not isinstance(rules, list):
+            raise ValueError("expected a list of rules")
+    except (OSError, ValueError) as e:
+        print(f"Error reading masks from {MASKS_FILE}: {e}")
+        rules = []
+
+    base = os.path.dirname(os.path.abspath(MASKS_FILE))
+    for rule in rules:
+        if rule.get('image'):
+            rule['image'] = os.path.join(base, rule['image'])
+
+    with _rules_lock:
+        _rules = (identity, rules)
+    return rules
+
+def mask_for(target, movie):
+    """Combine every rule matching a movie of a target into a Mask, or None if none match."""
+    regions, ignore, images = [], [], []
+    for rule in load_mask_rules():
+        if fnmatch.fnmatchcase(target, rule.get('target', '*')) and fnmatch.fnmatchcase(movie, rule.get('movie', '*')):
+            regions.extend(tuple(rect) for rect in rule.get('regions', ()))
+            ignore.extend(tuple(rect) for rect in rule.get('ignore', ()))
+            if rule.get('image'):
+                images.append(rule['image'])
+
+    if not (regions or ignore or images):
+        return None
+
+    key = hashlib.blake2b(json.dumps([regions, ignore, [file_fingerprint(path) for path in images]]).encode('utf-8'),
+                          digest_size=8).hexdigest()
+    return Mask(tuple(regions), tuple(ignore), tuple(images), key)
+
+def build_mask_array(mask, size):
+    width, height = size
+    if mask.regions:
+        compared = np.zeros((height, width), dtype=np.bool_)
+        for left, top, right, bottom in mask.regions:
+            compared[max(top, 0):bottom, max(left, 0):right] = True
+    else:
+        compared = np.ones((height, width), dtype=np.bool_)
+
+    for left, top, right, bottom in mask.ignore:
+        compared[max(top, 0):bottom, max(left, 0):right] = False
+
+    for path in mask.images:
+        with Image.open(path) as image:
+            image = image.convert('L')
+            if image.size != size:
+                image = image.resize(size, Image.NEAREST)
+            compared &= np.asarray(image) > 0
+
+    rows = np.flatnonzero(compared.any(axis=1))
+    cols = np.flatnonzero(compared.any(axis=0))
+    if not rows.size:
+        return compared[:0, :0], (0, 0, 0, 0)
+    box = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+    return compared[box[1]:box[3], box[0]:box[2]], box
+
+_mask_arrays = OrderedDict()
+_mask_arrays_lock = threading.Lock()
+
+def mask_array(mask, size):
+    """
+    Return (compared, box) for frames of size (width, height).
+
+    box is the bounding box of the compared pixels and compared the boolean
+    array of pixels to compare within it. Arrays are built once per mask and
+    frame size, and pixels outside box are never diffed.
+    """
+    key = (mask, size)
+    with _mask_arrays_lock:
+        cached = _mask_arrays.get(key)
+        if cached is not None:
+            _mask_arrays.move_to_end(key)
+            return cached
+
+    cached = build_mask_array(mask, size)
+    cached[0].flags.writeable = False
+    with _mask_arrays_lock:
+        _mask_arrays[key] = cached
+        while len(_mask_arrays) > MASK_ARRAYS_KEPT:
+            _mask_arrays.popitem(last=False)
+    return cached
@@ -0,0 +1,158 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+# Help text and type of every exported metric, in /metrics order
+METRICS = {
+    'imagediff_stage_seconds_total': ('counter', "Time spent in each stage of the diff pipeline."),
+    'imagediff_stage_calls_total': ('counter', "Calls of each stage of the diff pipeline."),
+    'imagediff_cache_requests_total': ('counter', "Diff cache lookups by table and result."),
+    'imagediff_http_requests_total': ('counter', "HTTP requests by endpoint and status."),
+    'imagediff_http_request_seconds_total': ('counter', "Time spent answering HTTP requests by endpoint."),
+}
+
+class Registry:
+    """Process-wide counters, keyed on metric name and a tuple of (label, value) pairs."""
+
+    def __init__(self):
+        self.values = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, samples):
+        with self._lock:
+            self.values.update(samples)
+
+    def snapshot(self):
+        with self._lock:
+            return Counter(self.values)
+
+registry = Registry()
+
+_local = threading.local()
+
+def record(name, labels, value=1):
+    """Add value to a counter."""
+    merge({(name, labels): value})
+
+def merge(samples):
+    """Add samples to the counters and to every collector active in this thread."""
+    registry.add(samples)
+    for collector in getattr(_local, 'collectors', ()):
+        collector.update(samples)
+
+@contextmanager
+def collecting():
+    """Collect the samples recorded by this thread, for Server-Timing and for worker processes."""
+    collector = Counter()
+    collectors = _local.__dict__.setdefault('collectors', [])
+    collectors.append(collector)
+    try:
+        yield collector
+    finally:
+        collectors.remove(collector)
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        labels = (('stage', stage),)
+        merge({('imagediff_stage_seconds_total', labels): time.perf_counter() - start,
+               ('imagediff_stage_calls_total', labels): 1})
+
+def timed_stage(stage):
+    """Decorate a function to count its calls and time under stage."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_cache_lookup(table, hit):
+    record('imagediff_cache_requests_total', (('table', table), ('result', 'hit' if hit else 'miss')))
+
+def stage_durations(samples):
+    """Seconds per stage in a collector, longest first."""
+    durations = {dict(labels)['stage']: value for (name, labels), value in samples.items()
+                 if name == 'imagediff_stage_seconds_total'}
+    return sorted(durations.items(), key=lambda item: -item[1])
+
+def server_timing(samples):
+    """Format the stage durations of a collector as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stage_durations(samples))
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+def render_prometheus(gauges=()):
+    """
+    Render every counter and the given gauges in the Prometheus text format.
+
+    gauges is a list of (name, help, [(labels, value)]).
+    """
+    values = registry.snapshot()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (sample_name, labels), value in sorted(values.items()):
+            if sample_name == name:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+    for name, help_text, samples in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+class SamplingProfiler:
+    """
+    Sample the stacks of every thread of the process every interval seconds.
+
+    The report uses the collapsed stack format of flamegraph.pl and
+    speedscope: one "thread;outer;...;inner count" line per distinct stack.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='imagediff-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join([names.get(ident, str(ident))] + stack[::-1])] += 1
+
+    def report(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
@@ -0,0 +1,102 @@
+import json
+import os
+
+from imagediff2.config import SCREENSHOTS_DIR
+from imagediff2.cache import diff_cache, file_identity
+from imagediff2.imagediff import movie_diff
+from imagediff2.jobs import report_progress
+from imagediff2.kernel import masked_options, options_variant
+from imagediff2.manifest import get_manifest, list_subdirs, sorted_builds
+
+def build_report(build, options=None):
+    """
+    Compare every movie of a build against the previous build of each target.
+
+    Each movie goes through movie_diff, so cached verdicts, the coarse
+    signature pass and the worker pool are shared with the other pages.
+
+    Returns {target: {'prev_build', 'movies', 'movie_diffs'}} for the
+    targets containing the build.
+    """
+    target_info = {}
+    for target in list_subdirs(SCREENSHOTS_DIR):
+        builds = sorted_builds(os.path.join(SCREENSHOTS_DIR, target))
+        if build not in builds:
+            continue
+
+        build_index = builds.index(build)
+        prev_build = builds[build_index + 1] if build_index < len(builds) - 1 else None
+        manifest = get_manifest(os.path.join(SCREENSHOTS_DIR, target, build))
+        target_info[target] = {
+            'prev_build': prev_build,
+            'movies': sorted(manifest.movie_names()),
+            'movie_diffs': {}
+        }
+
+    compared = [(target, info) for target, info in target_info.items() if info['prev_build'] is not None]
+    done = 0
+    report_progress(0, sum(len(info['movies']) for _, info in compared))
+    for target, info in compared:
+        for movie in info['movies']:
+            info['movie_diffs'][movie] = movie_diff(build, info['prev_build'], target, movie, options)
+            done += 1
+            report_progress(done)
+        report_progress(partial={target: info})
+
+    return target_info
+
+def history_key(target, movie, options):
+    return f"{options_variant(masked_options(options, target, movie))}|{target}|{movie}"
+
+def movie_history(target, movie, options=None, builds=None, identities=None):
+    """
+    Return the history of a movie in a target: the builds containing it,
+    newest first, and the verdict of every consecutive pair of them.
+
+    The history is kept in the diff cache together with the identity of
+    every build directory it was computed from. Only builds added or
+    changed since are scanned again, and only the pairs next to them are
+    compared, so an unchanged history costs one stat per build. builds and
+    their identities can be passed when updating many movies of a target.
+    """
+    target_path = os.path.join(SCREENSHOTS_DIR, target)
+    if builds is None:
+        builds = sorted_builds(target_path)
+    if identities is None:
+        identities = {build: file_identity(os.path.join(target_path, build)) for build in builds}
+
+    key = history_key(target, movie, options)
+    data = diff_cache.get_history(key)
+    history = json.loads(data) if data is not None else {'builds': {}, 'with_movie': [], 'verdicts': []}
+
+    changed = {build for build in builds if history['builds'].get(build) != identities[build]}
+    if not changed and len(history['builds']) == len(builds):
+        return history
+
+    had_movie = set(history['with_movie'])
+    with_movie = [build for build in builds
+                  if (get_manifest(os.path.join(target_path, build)).has_movie(movie) if build in changed
+                      else build in had_movie)]
+
+    known = {(current, prev): has_diff for current, prev, has_diff in history['verdicts']}
+    verdicts = []
+    for current, prev in zip(with_movie, with_movie[1:]):
+        has_diff = known.get((current, prev))
+        if has_diff is None or current in changed or prev in changed:
+            has_diff = movie_diff(current, prev, target, movie, options)
+        verdicts.append([current, prev, has_diff])
+
+    history = {'builds': identities, 'with_movie': with_movie, 'verdicts': verdicts}
+    diff_cache.put_history(key, json.dumps(history))
+    return history
+
+def update_movie_histories(target, options=None):
+    """Bring the history of every movie of a target up to date, scanning its builds once."""
+    target_path = os.path.join(SCREENSHOTS_DIR, target)
+    builds = sorted_builds(target_path)
+    identities = {build: file_identity(os.path.join(target_path, build)) for build in builds}
+    movies = set()
+    for build in builds:
+        movies |= get_manifest(os.path.join(target_path, build)).movie_names()
+    for movie in sorted(movies):
+        movie_history(target, movie, options, builds, identities)
@@ -0,0 +1,133 @@
+import json
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import wraps
+
+from flask import (Response, copy_current_request_context, jsonify, make_response, render_template, request,
+                   url_for)
+
+from imagediff2.config import HEAVY_WORKERS, JOB_WAIT, JOB_HISTORY, SERVER_TIMING
+from imagediff2.jobs import JobQueue, screenshots_fingerprint, write_output
+from imagediff2.metrics import collecting, server_timing, timed
+
+_heavy_executor = None
+_heavy_executor_lock = threading.Lock()
+
+def get_heavy_executor():
+    """Return the thread pool slow views run on."""
+    global _heavy_executor
+    with _heavy_executor_lock:
+        if _heavy_executor is None:
+            _heavy_executor = ThreadPoolExecutor(max_workers=max(HEAVY_WORKERS, 1),
+                                                 thread_name_prefix='imagediff-heavy')
+    return _heavy_executor
+
+jobs = JobQueue(get_heavy_executor, JOB_HISTORY)
+
+def job_status(job, partial_since=None):
+    """JSON-ready status of a job, with the URL to poll it."""
+    return {**job.to_dict(partial_since), 'status_url': url_for('job_status_api', job_id=job.id)}
+
+def job_view(kind, target_arg=None):
+    """
+    Run a slow view as a background job on the heavy executor.
+
+    Identical requests (same path and query string) share one job, also
+    after it finished, until a build of the target named by the target_arg
+    view argument (of any target without one) changes. At most HEAVY_WORKERS
+    jobs run at once, so a burst of matrix requests cannot starve /,
+    /screenshots or thumbnails; frame comparisons themselves still run on
+    the process pool of the diff engine.
+
+    The request waits up to JOB_WAIT seconds for the result. After that it
+    answers 202 with the job status, as JSON for /api/ routes and as a page
+    that reloads once the job is done otherwise. The job keeps running
+    when the client goes away.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            @copy_current_request_context
+            def render():
+                with collecting() as samples:
+                    response = make_response(view(*args, **kwargs))
+                # Every viewer gets its own response built from these, timed as computed by the job
+                headers = list(response.headers.items())
+                if SERVER_TIMING and samples:
+                    headers.append(('Server-Timing', server_timing(samples)))
+                return response.get_data(), response.status_code, headers
+
+            fingerprint = screenshots_fingerprint(kwargs[target_arg] if target_arg else None)
+            job = jobs.submit(kind, request.full_path, fingerprint, render)
+            with timed('job_wait'):
+                wait([job.future], timeout=JOB_WAIT)
+
+            if job.status == 'done':
+                return job.result
+            if job.status == 'failed':
+                raise job.exception
+            if request.path.startswith('/api/'):
+                return jsonify(job_status(job)), 202
+            return render_template('job.html', job=job_status(job)), 202
+
+        return wrapper
+    return decorator
+
+def job_stream(kind, target_arg=None, mimetype='application/x-ndjson'):
+    """
+    Run a streaming view as a background job and stream its output.
+
+    The view returns a generator of chunks, or a regular response for a bad
+    request. Jobs are shared and reused like those of job_view and run on
+    the same heavy executor, and the chunks are kept on the job: a viewer
+    gets the chunks produced so far, then follows the job until it is done.
+    The job keeps running when the client goes away. Once it is done and
+    has no viewer left, its output is released, and the next request runs
+    the view again, from the warm diff cache.
+
+    The request waits up to JOB_WAIT seconds for the first chunk, so a
+    response returned by the view keeps its status code. A response
+    returned later, once streaming started, becomes the last chunk of the
+    stream, and a job that fails ends it with an {"error": ...} line.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            @copy_current_request_context
+            def render():
+                result = view(*args, **kwargs)
+                if not isinstance(result, types.GeneratorType):
+                    response = make_response(result)
+                    return response.get_data(), response.status_code, list(response.headers.items())
+                for chunk in result:
+                    write_output(chunk)
+                return None
+
+            fingerprint = screenshots_fingerprint(kwargs[target_arg] if target_arg else None)
+            job = jobs.submit(kind, request.full_path, fingerprint, render)
+            while not job.attach():
+                job = jobs.submit(kind, request.full_path, fingerprint, render)
+            with timed('job_wait'):
+                job.wait_for_output(JOB_WAIT)
+
+            if job.status == 'failed' and not job.output:
+                job.detach()
+                raise job.exception
+            if job.result is not None:
+                job.detach()
+                return job.result
+
+            def follow():
+                yield from job.follow()
+                if job.result is not None:
+                    yield job.result[0]
+                elif job.status == 'failed':
+                    yield json.dumps({'error': str(job.exception)}) + "\n"
+
+            response = Response(follow(), mimetype=mimetype)
+            response.call_on_close(job.detach)
+            return response
+
+        return wrapper
+    return decorator
@@ -0,0 +1,113 @@
+from collections import namedtuple
+
+import numpy as np
+
+from imagediff2.cache import diff_cache
+from imagediff2.config import SIGNATURE_GRID
+from imagediff2.decode import open_images
+from imagediff2.fingerprint import file_fingerprint
+from imagediff2.kernel import as_rgb_array
+
+# Modes for which a change of the RGB block sums is also a change seen by the PIL kernel
+EXACT_MODES = ('RGB', 'RGBA', 'L')
+
+Signature = namedtuple('Signature', ['mode', 'width', 'height', 'sums'])
+
+def block_edges(length, grid):
+    """Start offsets of the blocks along one axis, without empty blocks."""
+    return np.unique(np.linspace(0, length, grid + 1, dtype=np.int64)[:-1])
+
+def block_counts(width, height, grid=SIGNATURE_GRID):
+    """Number of pixels in every block of a width x height frame."""
+    rows = np.diff(np.append(block_edges(height, grid), height))
+    cols = np.diff(np.append(block_edges(width, grid), width))
+    return np.outer(rows, cols)
+
+def compute_signature(image, grid=SIGNATURE_GRID):
+    """
+    Summarize an image as the per-channel pixel sums of a grid x grid
+    partition of the frame. The sums are exact integers, so comparing two
+    signatures never suffers from rounding.
+    """
+    pixels = as_rgb_array(image)
+    height, width = pixels.shape[:2]
+    if not height or not width:
+        return Signature(image.mode, width, height, np.zeros((0, 0, 3), dtype=np.int64))
+
+    sums = np.add.reduceat(pixels, block_edges(height, grid), axis=0, dtype=np.int64)
+    sums = np.add.reduceat(sums, block_edges(width, grid), axis=1)
+    return Signature(image.mode, width, height, sums)
+
+def signature_key(path):
+    return f"{SIGNATURE_GRID}:{file_fingerprint(path)}"
+
+def load_signature(path):
+    """Return the cached signature of a frame, or None."""
+    row = diff_cache.get_signature(signature_key(path))
+    if row is None:
+        return None
+    mode, width, height, data = row
+    sums = np.frombuffer(data, dtype='<i8').reshape(len(block_edges(height, SIGNATURE_GRID)),
+                                                    len(block_edges(width, SIGNATURE_GRID)), 3)
+    return Signature(mode, width, height, sums)
+
+def store_signature(path, image):
+    """Compute the signature of an already decoded frame and cache it."""
+    signature = compute_signature(image)
+    diff_cache.put_signature(signature_key(path), signature.mode, signature.width, signature.height,
+                             signature.sums.astype('<i8').tobytes())
+    return signature
+
+def get_signature(path, compute=True):
+    """
+    Return the signature of a frame from the cache, decoding the frame to
+    compute it only when compute is True. Returns None if it is unavailable.
+    """
+    signature = load_signature(path)
+    if signature is None and compute:
+        with open_images(path, copies=2) as (image,):
+            signature = store_signature(path, image)
+    return signature
+
+def changed_pixels_lower_bound(src_sig, cmp_sig, options):
+    """
+    Lower bound of the number of pixels the full comparison would count as
+    changed, or None if the signatures cannot be compared.
+
+    In a block of n pixels where every unchanged pixel moves a channel by
+    at most t, a change s of that channel's sum needs at least
+    (s - n*t) / (255 - t) changed pixels. Blocks are disjoint, so their
+    bounds add up.
+    """
+    if options.mask is not None or (src_sig.width, src_sig.height) != (cmp_sig.width, cmp_sig.height):
+        return None
+    if options.kernel == 'pil' and not (src_sig.mode == cmp_sig.mode and src_sig.mode in EXACT_MODES):
+        return None
+
+    tolerance = np.asarray(options.channel_tolerance, dtype=np.int64)
+    if (tolerance >= 255).any():
+        return None
+
+    counts = block_counts(src_sig.width, src_sig.height)[:, :, None]
+    excess = np.abs(src_sig.sums - cmp_sig.sums) - counts * tolerance
+    # Ceiling division in integers, a block needs at least one changed pixel per channel in excess
+    bound = -(-np.maximum(excess, 0) // (255 - tolerance))
+    return int(bound.max(axis=2).sum())
+
+def coarse_differs(src_img_path, cmp_img_path, options, compute=False):
+    """
+    Compare the signatures of two frames.
+
+    Returns True when the frames certainly differ under options, and None
+    when only the full-resolution comparison can tell. The coarse pass never
+    reports two frames as identical.
+    """
+    src_sig = get_signature(src_img_path, compute)
+    cmp_sig = get_signature(cmp_img_path, compute) if src_sig is not None else None
+    if src_sig is None or cmp_sig is None:
+        return None
+
+    bound = changed_pixels_lower_bound(src_sig, cmp_sig, options)
+    if bound is not None and bound > options.pixel_tolerance:
+        return True
+    return None
@@ -0,0 +1,47 @@
+import os
+import threading
+
+from imagediff2.config import THUMBNAIL_DIR, THUMBNAIL_SIZES, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY
+from imagediff2.decode import open_images
+from imagediff2.fingerprint import file_fingerprint
+from imagediff2.metrics import timed
+
+THUMBNAIL_MIMETYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+THUMBNAIL_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+def thumbnail_mimetype():
+    return THUMBNAIL_MIMETYPES[THUMBNAIL_FORMAT]
+
+def thumbnail_path(digest, size):
+    """Location of a thumbnail in the content-addressed store."""
+    return os.path.join(THUMBNAIL_DIR, digest[:2], f"{digest}-{size}.{THUMBNAIL_EXTENSIONS[THUMBNAIL_FORMAT]}")
+
+def thumbnail_file(image_path, size):
+    """
+    Return the path of a thumbnail fitting in size x size pixels, rendering it once.
+
+    Thumbnails are keyed on the content digest of the image, so byte-identical
+    frames of different builds share a single thumbnail.
+    """
+    if size not in THUMBNAIL_SIZES:
+        raise ValueError(f"Unsupported thumbnail size {size}")
+
+    path = thumbnail_path(file_fingerprint(image_path), size)
+    if os.path.exists(path):
+        return path
+
+    # Lets JPEG sources decode at reduced resolution, a no-op for PNG
+    with timed('thumbnail'), open_images(image_path, size=(size, size)) as (image,):
+        image = image.convert('RGB')
+        image.thumbnail((size, size))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    image.save(tmp_path, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+    os.replace(tmp_path, path)
+    return path
+
+def generate_thumbnails(image_path):
+    """Render every configured thumbnail size of an image."""
+    for size in THUMBNAIL_SIZES:
+        thumbnail_file(image_path, size)
@@ -0,0 +1,65 @@
+def lowest_bit_above(bits, index):
+    """Return the position of the lowest set bit of bits above index, or None."""
+    bits >>= index + 1
+    if not bits:
+        return None
+    return (bits & -bits).bit_length() - 1 + index + 1
+
+class MovieTimeline:
+    """
+    Presence of every movie and frame over the build order of a target.
+
+    builds is ordered newest first, like get_sorted_builds, and bit i of
+    every bitset stands for builds[i]. So "older" means a higher bit.
+    """
+
+    def __init__(self, builds, build_movie_frames):
+        self.builds = builds
+        self.positions = {build: i for i, build in enumerate(builds)}
+        self.build_movie_frames = build_movie_frames
+        self.presence = {}
+        self.frame_presence = {}
+
+        for i, build in enumerate(builds):
+            for movie, frames in build_movie_frames.get(build, {}).items():
+                self.presence[movie] = self.presence.get(movie, 0) | (1 << i)
+                movie_frames = self.frame_presence.setdefault(movie, {})
+                for frame in frames:
+                    movie_frames[frame] = movie_frames.get(frame, 0) | (1 << i)
+
+    def movies(self):
+        return set(self.presence)
+
+    def has_movie(self, build, movie):
+        return bool(self.presence.get(movie, 0) >> self.positions[build] & 1)
+
+    def first_build(self, movie):
+        """Return the oldest build containing movie."""
+        bits = self.presence.get(movie, 0)
+        return self.builds[bits.bit_length() - 1] if bits else None
+
+    def next_build_with_movie(self, build, movie):
+        """Return the closest build older than build containing movie."""
+        position = lowest_bit_above(self.presence.get(movie, 0), self.positions[build])
+        return None if position is None else self.builds[position]
+
+    def next_build_with_common_frames(self, build, movie):
+        """
+        Return the closest build older than build sharing at least one frame
+        of movie with it, and the shared frames in the order of build.
+
+        Returns (None, []) if there is no such build.
+        """
+        frames = self.build_movie_frames.get(build, {}).get(movie, [])
+        frame_presence = self.frame_presence.get(movie, {})
+
+        bits = 0
+        for frame in frames:
+            bits |= frame_presence.get(frame, 0)
+
+        position = lowest_bit_above(bits, self.positions[build])
+        if position is None:
+            return None, []
+
+        reference_build = self.builds[position]
+        return reference_build, [f for f in frames if frame_presence[f] >> position & 1]